@@ -1,14 +1,35 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, render_template, request, jsonify, send_file, Response, stream_with_context
 from flask_cors import CORS
 import requests
-import pandas as pd
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from openpyxl import Workbook
+import numpy as np
 import os
 import json
-from datetime import datetime
+import csv
+import io
+import tempfile
+import base64
+import hashlib
+import uuid
+import codecs
+from datetime import datetime, timezone
 import time
+import random
+import math
+import heapq
 import re
-from urllib.parse import urljoin, urlparse
-from threading import Lock
+import unicodedata
+from urllib.parse import urljoin, urlparse, unquote
+from html.parser import HTMLParser
+from threading import Lock, Condition, Event, Thread, local
+from collections import OrderedDict, deque
+from contextvars import Context, ContextVar, copy_context
+from contextlib import contextmanager
+import itertools
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
 import signal
 # Load environment variables from .env file (for local development)
 try:
@@ -18,84 +39,628 @@ except ImportError:
     # dotenv not installed, that's OK - use environment variables or config.py
     pass
 
-# Global progress tracking
-progress_lock = Lock()
-current_progress = {
-    'status': 'idle',
-    'current_step': '',
-    'companies_found': 0,
-    'total_steps': 0,
-    'current_step_num': 0,
-    'details': []
-}
+# Progress tracking per search job
+PROGRESS_MAX_DETAILS = 50  # Detail events kept per job
+PROGRESS_FLUSH_INTERVAL = float(os.environ.get('PROGRESS_FLUSH_INTERVAL', '0.5'))  # Seconds between writes to the shared store
+FINISHED_PROGRESS_STATUSES = ('completed', 'failed')
+SSE_HEARTBEAT_INTERVAL = float(os.environ.get('SSE_HEARTBEAT_INTERVAL', '15'))  # Seconds between keep-alive comments
+SSE_POLL_INTERVAL = 0.5  # Seconds between reads of the shared store for jobs run by another worker
+
+# Job id of the search the current thread is working for
+current_job_id = ContextVar('current_job_id', default=None)
+
+# Absolute time (time.time()) the current search must finish by; copied into worker threads with the job id
+current_deadline = ContextVar('current_deadline', default=None)
+
+# Cancel events (threading.Event) of the work the current thread belongs to, outermost first
+current_cancel_events = ContextVar('current_cancel_events', default=())
+
+class DeadlineExceeded(Exception):
+    """The current search ran out of time"""
+
+@contextmanager
+def deadline_scope(seconds):
+    """Run the block under a deadline `seconds` from now (or the current one, if that is sooner)"""
+    deadline = time.time() + seconds
+    outer = current_deadline.get()
+    token = current_deadline.set(deadline if outer is None else min(outer, deadline))
+    try:
+        yield
+    finally:
+        current_deadline.reset(token)
+
+@contextmanager
+def cancel_scope():
+    """Run the block with a cancel event; setting it ends the time of all work
+    started from the block (and copied into worker threads) as if the deadline had passed"""
+    event = Event()
+    token = current_cancel_events.set(current_cancel_events.get() + (event,))
+    try:
+        yield event
+    finally:
+        current_cancel_events.reset(token)
+
+def is_cancelled():
+    return any(event.is_set() for event in current_cancel_events.get())
+
+def time_remaining():
+    """Seconds left before the current deadline (infinite without one, 0 once cancelled)"""
+    if is_cancelled():
+        return 0.0
+    deadline = current_deadline.get()
+    return float('inf') if deadline is None else deadline - time.time()
+
+def wait_budget():
+    """Time left as a timeout for wait()/Future.result() - None without a deadline"""
+    remaining = time_remaining()
+    return None if remaining == float('inf') else max(remaining, 0)
+
+def check_deadline():
+    """Stop the current piece of work once the deadline has passed"""
+    if time_remaining() <= 0:
+        raise DeadlineExceeded('Search deadline passed')
 
-# Search history file path
+def request_timeout(timeout):
+    """Cap an HTTP timeout (seconds or a (connect, read) tuple) at the time left before the deadline"""
+    remaining = time_remaining()
+    if remaining <= 0:
+        raise DeadlineExceeded('Search deadline passed')
+    if remaining == float('inf'):
+        return timeout
+    if timeout is None:
+        return remaining
+    if isinstance(timeout, tuple):
+        return tuple(remaining if t is None else min(t, remaining) for t in timeout)
+    return min(timeout, remaining)
+
+# Search history is kept in the shared SQLite database; the old JSON file is imported once
 HISTORY_FILE = 'search_history.json'
-history_lock = Lock()
 MAX_HISTORY_ITEMS = 1000  # Maximum items to store globally
+HISTORY_PAGE_SIZE = 100  # Default items per GET /api/history page
+
+# SQLite database on the persistent disk (Render mounts it at exports/), shared by all gunicorn workers
+DATA_DB_PATH = os.environ.get('DATA_DB_PATH', os.path.join('exports', 'leadgen.db'))
+db_local = local()
+
+def get_db():
+    """Get this thread's connection to the shared SQLite database"""
+    conn = getattr(db_local, 'conn', None)
+    if conn is None:
+        db_dir = os.path.dirname(DATA_DB_PATH)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        # Autocommit mode; WAL lets readers in other workers run alongside a writer
+        conn = sqlite3.connect(DATA_DB_PATH, timeout=10, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        db_local.conn = conn
+    return conn
 
-def update_progress(status, step, companies=0, detail=''):
-    """Update progress tracking"""
-    global current_progress
-    with progress_lock:
-        current_progress['status'] = status
-        current_progress['current_step'] = step
-        current_progress['companies_found'] = companies
+# All caches by name, for /api/cache/stats
+cache_registry = {}
+
+class TieredCache:
+    """Two-tier TTL cache: an in-process LRU in front of a SQLite table shared by all workers.
+    
+    With stale_ttl, expired entries are kept that much longer and get_entry() still returns
+    them, flagged as stale, so callers can serve them while they refresh the value.
+    """
+    
+    PRUNE_EVERY = 100  # Prune the disk tier every N writes
+    
+    def __init__(self, namespace, ttl, max_memory_items=1000, max_disk_items=50000, stale_ttl=0, max_disk_bytes=None):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_memory_items = max_memory_items
+        self.max_disk_items = max_disk_items
+        self.max_disk_bytes = max_disk_bytes
+        self.memory = OrderedDict()  # key -> (value, expires_at)
+        self.lock = Lock()
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'stale_hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0}
+        self.table_ready = False
+        cache_registry[namespace] = self
+    
+    def _db(self):
+        conn = get_db()
+        if not self.table_ready:
+            conn.execute('''CREATE TABLE IF NOT EXISTS cache_entries (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_cache_entries_accessed ON cache_entries (namespace, accessed_at)')
+            self.table_ready = True
+        return conn
+    
+    def _remember(self, key, value, expires_at):
+        """Put an entry in the memory tier (caller holds self.lock)"""
+        self.memory[key] = (value, expires_at)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_items:
+            self.memory.popitem(last=False)
+            self.stats['evictions'] += 1
+    
+    def get(self, key):
+        """Return the cached value, or None if missing or expired"""
+        entry = self.get_entry(key)
+        if entry is None or not entry[1]:
+            return None
+        return entry[0]
+    
+    def get_entry(self, key):
+        """Return (value, is_fresh), or None if missing or past its stale window"""
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                if entry[1] + self.stale_ttl > now:
+                    self.memory.move_to_end(key)
+                    fresh = entry[1] > now
+                    self.stats['memory_hits' if fresh else 'stale_hits'] += 1
+                    return entry[0], fresh
+                del self.memory[key]
+        
+        try:
+            conn = self._db()
+            row = conn.execute(
+                'SELECT value, expires_at FROM cache_entries WHERE namespace = ? AND key = ?',
+                (self.namespace, key)
+            ).fetchone()
+            if row and row[1] + self.stale_ttl > now:
+                value = json.loads(row[0])
+                conn.execute(
+                    'UPDATE cache_entries SET accessed_at = ? WHERE namespace = ? AND key = ?',
+                    (now, self.namespace, key)
+                )
+                fresh = row[1] > now
+                with self.lock:
+                    self._remember(key, value, row[1])
+                    self.stats['disk_hits' if fresh else 'stale_hits'] += 1
+                return value, fresh
+        except sqlite3.Error as e:
+            print(f'Error reading {self.namespace} cache: {e}')
+        
+        with self.lock:
+            self.stats['misses'] += 1
+        return None
+    
+    def set(self, key, value, ttl=None):
+        """Store a JSON-serializable value in both tiers"""
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        with self.lock:
+            self._remember(key, value, expires_at)
+            self.stats['writes'] += 1
+            prune = self.stats['writes'] % self.PRUNE_EVERY == 0
+        
+        try:
+            conn = self._db()
+            conn.execute(
+                'INSERT OR REPLACE INTO cache_entries (namespace, key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)',
+                (self.namespace, key, json.dumps(value, ensure_ascii=False), expires_at, now)
+            )
+            # Caches with a byte budget hold few, large entries - keep them within budget on every write
+            if prune or self.max_disk_bytes:
+                self._prune(conn, now)
+        except sqlite3.Error as e:
+            print(f'Error writing {self.namespace} cache: {e}')
+    
+    def _prune(self, conn, now):
+        """Drop expired entries, then least recently used ones above the size caps"""
+        conn.execute('DELETE FROM cache_entries WHERE namespace = ? AND expires_at <= ?', (self.namespace, now - self.stale_ttl))
+        count = conn.execute('SELECT COUNT(*) FROM cache_entries WHERE namespace = ?', (self.namespace,)).fetchone()[0]
+        if count > self.max_disk_items:
+            conn.execute(
+                '''DELETE FROM cache_entries WHERE namespace = ? AND key IN (
+                    SELECT key FROM cache_entries WHERE namespace = ? ORDER BY accessed_at LIMIT ?
+                )''',
+                (self.namespace, self.namespace, count - self.max_disk_items)
+            )
+            with self.lock:
+                self.stats['evictions'] += count - self.max_disk_items
+        
+        if self.max_disk_bytes:
+            total = conn.execute(
+                'SELECT COALESCE(SUM(LENGTH(value)), 0) FROM cache_entries WHERE namespace = ?', (self.namespace,)
+            ).fetchone()[0]
+            if total > self.max_disk_bytes:
+                rows = conn.execute(
+                    'SELECT key, LENGTH(value) FROM cache_entries WHERE namespace = ? ORDER BY accessed_at',
+                    (self.namespace,)
+                ).fetchall()
+                evicted = []
+                for key, size in rows:
+                    if total <= self.max_disk_bytes:
+                        break
+                    evicted.append((self.namespace, key))
+                    total -= size
+                conn.executemany('DELETE FROM cache_entries WHERE namespace = ? AND key = ?', evicted)
+                with self.lock:
+                    self.stats['evictions'] += len(evicted)
+    
+    def get_stats(self):
+        """Hit/miss counters for this worker process"""
+        with self.lock:
+            stats = dict(self.stats)
+            stats['memory_items'] = len(self.memory)
+        hits = stats['memory_hits'] + stats['disk_hits'] + stats['stale_hits']
+        lookups = hits + stats['misses']
+        stats['hit_ratio'] = round(hits / lookups, 3) if lookups else 0.0
+        return stats
+
+class JobProgress:
+    """Progress of one search job.
+    
+    Updated from the job's worker threads. Attribute writes are atomic in CPython;
+    detail events take the per-job condition's lock so their ids are appended in
+    order. The condition also wakes up event streams of this job.
+    """
+    
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.status = 'starting'
+        self.current_step = 'Initializing search...'
+        self.companies_found = 0
+        self.total_steps = 0
+        self.current_step_num = 0
+        self.details = deque(maxlen=PROGRESS_MAX_DETAILS)
+        self.companies = []  # Companies accepted so far, for streamed results
+        self.company_names = set()
+        self.event_ids = itertools.count(1)
+        self.last_event_id = 0
+        self.finished = False
+        self.versions = itertools.count(1)
+        self.version = 0
+        self.changed = Condition()
+        self.updated_at = time.time()
+        self.flushed_at = 0.0
+    
+    def touch(self):
+        """Record a change and wake up anyone streaming this job's events"""
+        self.updated_at = time.time()
+        self.version = next(self.versions)
+        with self.changed:
+            self.changed.notify_all()
+    
+    def wait_for_change(self, seen_version, timeout):
+        with self.changed:
+            self.changed.wait_for(lambda: self.version != seen_version, timeout)
+    
+    def snapshot(self):
+        with self.changed:
+            details = list(self.details)
+        return {
+            'job_id': self.job_id,
+            'status': self.status,
+            'current_step': self.current_step,
+            'companies_found': self.companies_found,
+            'total_steps': self.total_steps,
+            'current_step_num': self.current_step_num,
+            'details': details,
+            'last_event_id': self.last_event_id,
+            'finished': self.finished,
+            'updated_at': self.updated_at
+        }
+
+class ProgressStore:
+    """Per-job progress, kept in memory by the worker running the job and
+    written through (throttled) to SQLite so every gunicorn worker can read it"""
+    
+    def __init__(self):
+        self.jobs = {}  # job_id -> JobProgress for jobs running in this process
+        self.table_ready = False
+    
+    def _db(self):
+        conn = get_db()
+        if not self.table_ready:
+            conn.execute('''CREATE TABLE IF NOT EXISTS job_progress (
+                job_id TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )''')
+            self.table_ready = True
+        return conn
+    
+    def start(self, job_id):
+        progress = JobProgress(job_id)
+        self.jobs[job_id] = progress
+        self.flush(progress)
+        return progress
+    
+    def update(self, job_id, status, step, companies=None, detail=''):
+        progress = self.jobs.get(job_id)
+        if progress is None:
+            return
+        
+        progress.status = status
+        progress.current_step = step
+        if companies is not None:
+            progress.companies_found = companies
         if detail:
-            current_progress['details'].append({
-                'time': datetime.now().strftime('%H:%M:%S'),
-                'message': detail
-            })
-            # Keep only last 50 details
-            if len(current_progress['details']) > 50:
-                current_progress['details'] = current_progress['details'][-50:]
+            # Ids must be appended in order, or a resuming client (Last-Event-ID) skips events
+            with progress.changed:
+                event_id = next(progress.event_ids)
+                progress.details.append({
+                    'id': event_id,
+                    'time': datetime.now().strftime('%H:%M:%S'),
+                    'message': detail
+                })
+                progress.last_event_id = event_id
+        progress.touch()
+        
+        # Throttle writes to the shared store, but always write the final state
+        if status in FINISHED_PROGRESS_STATUSES or progress.updated_at - progress.flushed_at >= PROGRESS_FLUSH_INTERVAL:
+            self.flush(progress)
+    
+    def flush(self, progress):
+        progress.flushed_at = time.time()
+        try:
+            self._db().execute(
+                'INSERT OR REPLACE INTO job_progress (job_id, state, updated_at) VALUES (?, ?, ?)',
+                (progress.job_id, json.dumps(progress.snapshot(), ensure_ascii=False), progress.updated_at)
+            )
+        except sqlite3.Error as e:
+            print(f'Error saving progress for job {progress.job_id}: {e}')
+    
+    def get(self, job_id):
+        """Progress snapshot of a job run by any worker, or None if unknown"""
+        progress = self.jobs.get(job_id)
+        if progress is not None:
+            return progress.snapshot()
+        try:
+            row = self._db().execute('SELECT state FROM job_progress WHERE job_id = ?', (job_id,)).fetchone()
+        except sqlite3.Error as e:
+            print(f'Error reading progress for job {job_id}: {e}')
+            return None
+        return json.loads(row[0]) if row else None
+    
+    def finish(self, job_id):
+        """Mark a job as finished and write its final state"""
+        progress = self.jobs.get(job_id)
+        if progress is not None:
+            progress.finished = True
+            progress.touch()
+            self.flush(progress)
+    
+    def prune(self, max_age):
+        """Forget jobs that haven't been updated for max_age seconds"""
+        cutoff = time.time() - max_age
+        for job_id, progress in list(self.jobs.items()):
+            if progress.updated_at < cutoff:
+                self.jobs.pop(job_id, None)
+        try:
+            self._db().execute('DELETE FROM job_progress WHERE updated_at < ?', (cutoff,))
+        except sqlite3.Error as e:
+            print(f'Error pruning progress: {e}')
+
+progress_store = ProgressStore()
+
+def format_sse(event, data, event_id=None):
+    """Format one Server-Sent Events message"""
+    message = f'event: {event}\n'
+    if event_id is not None:
+        message = f'id: {event_id}\n' + message
+    return message + f'data: {json.dumps(data, ensure_ascii=False)}\n\n'
+
+def progress_updates(snapshot, last_event_id, last_status):
+    """Progress updates a client hasn't seen yet: one per new detail, or one for a
+    status change without a detail. Returns (updates, last_event_id, status)."""
+    status = {
+        'job_id': snapshot['job_id'],
+        'status': snapshot['status'],
+        'current_step': snapshot['current_step'],
+        'companies_found': snapshot['companies_found'],
+        'total_steps': snapshot['total_steps'],
+        'current_step_num': snapshot['current_step_num']
+    }
+    new_details = [detail for detail in snapshot['details'] if detail['id'] > last_event_id]
+    updates = [dict(status, detail=detail) for detail in new_details]
+    if new_details:
+        last_event_id = new_details[-1]['id']
+    elif status != last_status:
+        updates.append(dict(status, detail=None))
+    return updates, last_event_id, status
+
+def stream_progress_events(job_id, last_event_id=0):
+    """Yield a job's progress as Server-Sent Events until the job finishes.
+    
+    Detail events carry their id so a reconnecting client (Last-Event-ID) only gets
+    the ones it missed; status changes without a detail are sent without an id.
+    """
+    yield 'retry: 2000\n\n'
+    seen_version = None
+    last_status = None
+    next_heartbeat = time.time() + SSE_HEARTBEAT_INTERVAL
+    
+    while True:
+        local_progress = progress_store.jobs.get(job_id)
+        if local_progress is not None:
+            seen_version = local_progress.version
+        snapshot = progress_store.get(job_id)
+        if snapshot is None:
+            yield format_sse('done', {'job_id': job_id, 'error': 'Unknown search job', 'finished': True})
+            return
+        
+        updates, last_event_id, status = progress_updates(snapshot, last_event_id, last_status)
+        for update in updates:
+            yield format_sse('progress', update, event_id=update['detail']['id'] if update['detail'] else None)
+        last_status = status
+        
+        if snapshot['finished']:
+            yield format_sse('done', dict(status, finished=True))
+            return
+        
+        if time.time() >= next_heartbeat:
+            yield ': heartbeat\n\n'
+            next_heartbeat = time.time() + SSE_HEARTBEAT_INTERVAL
+        
+        # Wake up as soon as this worker's job changes; poll the shared store for other workers' jobs
+        wait_timeout = max(0.0, next_heartbeat - time.time())
+        if local_progress is not None:
+            local_progress.wait_for_change(seen_version, wait_timeout)
+        else:
+            time.sleep(min(SSE_POLL_INTERVAL, wait_timeout))
+
+def publish_company(company):
+    """Make a company accepted by a provider available to streamed results right away"""
+    job_id = current_job_id.get()
+    progress = progress_store.jobs.get(job_id) if job_id and not is_cancelled() else None
+    if progress is None:
+        return
+    
+    # Skip companies another provider already published (final deduplication happens later)
+    name = normalize_company_name(company.get('name', ''))
+    with progress.changed:
+        if not name or name in progress.company_names:
+            return
+        progress.company_names.add(name)
+        progress.companies.append(company)
+    progress.touch()
+
+def update_progress(status, step, companies=None, detail=''):
+    """Update progress of the search job the current thread is working for
+    (not from work the job has stopped waiting for)"""
+    job_id = current_job_id.get()
+    if job_id and not is_cancelled():
+        progress_store.update(job_id, status, step, companies, detail)
+
+def submit_in_context(executor, fn, *args, **kwargs):
+    """Submit work to an executor so it keeps the caller's context (current job id and deadline)"""
+    return executor.submit(copy_context().run, fn, *args, **kwargs)
 
-def get_search_history():
-    """Read search history from file"""
+history_table_ready = False
+
+def get_history_db():
+    """Get a database connection with the search history table in place"""
+    global history_table_ready
+    conn = get_db()
+    if not history_table_ready:
+        conn.execute('''CREATE TABLE IF NOT EXISTS search_history (
+            id INTEGER PRIMARY KEY,
+            type TEXT NOT NULL,
+            query TEXT NOT NULL,
+            query_key TEXT NOT NULL,
+            industry_filter TEXT NOT NULL DEFAULT '',
+            timestamp TEXT NOT NULL,
+            updated_at REAL NOT NULL,
+            UNIQUE (type, query_key)
+        )''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_search_history_recent ON search_history (updated_at DESC)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_search_history_type_recent ON search_history (type, updated_at DESC)')
+        history_table_ready = True
+        import_legacy_history(conn)
+    return conn
+
+def import_legacy_history(conn):
+    """Move history from the old search_history.json file into the database (once)"""
+    if not os.path.exists(HISTORY_FILE):
+        return
+    if conn.execute('SELECT 1 FROM search_history LIMIT 1').fetchone():
+        return
     try:
-        if os.path.exists(HISTORY_FILE):
-            with history_lock:
-                with open(HISTORY_FILE, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-        return []
+        with open(HISTORY_FILE, 'r', encoding='utf-8') as f:
+            history = json.load(f)
     except Exception as e:
-        print(f'Error reading search history: {e}')
-        return []
+        print(f'Error reading legacy search history: {e}')
+        return
+    
+    # Oldest first, so the newest item ends up most recent
+    for item in reversed(history):
+        try:
+            updated_at = datetime.fromisoformat(item.get('timestamp', '')).timestamp()
+        except ValueError:
+            updated_at = time.time()
+        upsert_history_item(conn, item.get('type', 'industry'), item.get('query', ''),
+                            item.get('industry_filter', ''), item.get('timestamp', ''), updated_at)
+    print(f'Imported {len(history)} search history items from {HISTORY_FILE}')
 
-def save_search_history(history):
-    """Save search history to file"""
+def upsert_history_item(conn, search_type, query, industry_filter, timestamp, updated_at):
+    """Insert a history item, or move the existing one with the same type and query to the top"""
+    query = query.strip()
+    conn.execute(
+        '''INSERT INTO search_history (type, query, query_key, industry_filter, timestamp, updated_at)
+           VALUES (?, ?, ?, ?, ?, ?)
+           ON CONFLICT (type, query_key) DO UPDATE SET
+               query = excluded.query,
+               industry_filter = excluded.industry_filter,
+               timestamp = excluded.timestamp,
+               updated_at = excluded.updated_at''',
+        (search_type, query, query.lower(), industry_filter.strip(), timestamp, updated_at)
+    )
+
+def encode_history_cursor(updated_at, item_id):
+    return base64.urlsafe_b64encode(f'{updated_at!r}:{item_id}'.encode()).decode()
+
+def decode_history_cursor(cursor):
+    """Decode a page cursor into (updated_at, id); raises ValueError if it is malformed"""
     try:
-        with history_lock:
-            # Ensure directory exists
-            os.makedirs(os.path.dirname(HISTORY_FILE) if os.path.dirname(HISTORY_FILE) else '.', exist_ok=True)
-            with open(HISTORY_FILE, 'w', encoding='utf-8') as f:
-                json.dump(history, f, indent=2, ensure_ascii=False)
-    except Exception as e:
-        print(f'Error saving search history: {e}')
+        updated_at, item_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(':')
+        return float(updated_at), int(item_id)
+    except Exception:
+        raise ValueError('Invalid cursor')
 
-def add_to_history(search_type, query, industry_filter=''):
-    """Add a search to history"""
-    history = get_search_history()
-    new_item = {
-        'id': int(time.time() * 1000),  # Use timestamp as ID
-        'type': search_type,
-        'query': query.strip(),
-        'industry_filter': industry_filter.strip(),
-        'timestamp': datetime.now().isoformat()
-    }
+def get_search_history_page(search_type=None, limit=HISTORY_PAGE_SIZE, cursor=None):
+    """Read one page of search history, newest first.
     
-    # Remove duplicates (same type and query)
-    history = [item for item in history 
-               if not (item.get('type') == search_type and 
-                      item.get('query', '').lower() == query.strip().lower())]
+    Returns (items, next_cursor); next_cursor is None on the last page.
+    """
+    conditions = []
+    params = []
+    if search_type:
+        conditions.append('type = ?')
+        params.append(search_type)
+    if cursor:
+        updated_at, item_id = decode_history_cursor(cursor)
+        conditions.append('(updated_at < ? OR (updated_at = ? AND id < ?))')
+        params.extend([updated_at, updated_at, item_id])
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
     
-    # Add new item at the beginning
-    history.insert(0, new_item)
+    # One extra row tells whether there is a next page
+    rows = get_history_db().execute(
+        f'''SELECT id, type, query, industry_filter, timestamp, updated_at FROM search_history
+            {where} ORDER BY updated_at DESC, id DESC LIMIT ?''',
+        params + [limit + 1]
+    ).fetchall()
     
-    # Keep only last MAX_HISTORY_ITEMS
-    history = history[:MAX_HISTORY_ITEMS]
-    
-    save_search_history(history)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_history_cursor(rows[-1][5], rows[-1][0])
+    items = [
+        {'id': row[0], 'type': row[1], 'query': row[2], 'industry_filter': row[3], 'timestamp': row[4]}
+        for row in rows
+    ]
+    return items, next_cursor
+
+def get_history_version(search_type=None):
+    """(item count, last change time) of the history, for conditional GETs"""
+    if search_type:
+        row = get_history_db().execute(
+            'SELECT COUNT(*), MAX(updated_at) FROM search_history WHERE type = ?', (search_type,)
+        ).fetchone()
+    else:
+        row = get_history_db().execute('SELECT COUNT(*), MAX(updated_at) FROM search_history').fetchone()
+    return row[0], row[1] or 0.0
+
+def add_to_history(search_type, query, industry_filter=''):
+    """Add a search to history (same type and query replaces the older entry)"""
+    try:
+        conn = get_history_db()
+        upsert_history_item(conn, search_type, query, industry_filter, datetime.now().isoformat(), time.time())
+        
+        # Keep only last MAX_HISTORY_ITEMS
+        conn.execute(
+            '''DELETE FROM search_history WHERE id IN (
+                SELECT id FROM search_history ORDER BY updated_at DESC LIMIT -1 OFFSET ?
+            )''',
+            (MAX_HISTORY_ITEMS,)
+        )
+    except Exception as e:
+        print(f'Error saving search history: {e}')
 
 app = Flask(__name__)
 CORS(app)
@@ -111,6 +676,269 @@ except ImportError:
     ZOOMINFO_API_KEY = os.environ.get('ZOOMINFO_API_KEY', '')
     APOLLO_API_KEY = os.environ.get('APOLLO_API_KEY', '')
 
+# Number of place-details/email lookups run at the same time per location
+DETAILS_MAX_WORKERS = int(os.environ.get('DETAILS_MAX_WORKERS', '8'))
+
+# Deadline (seconds) for one whole search, shared by every provider and enrichment call.
+# Searches run as background jobs, so this is no longer tied to the platform request timeout.
+SEARCH_TIME_BUDGET = float(os.environ.get('SEARCH_TIME_BUDGET', '120'))
+MAX_COMPANIES = int(os.environ.get('MAX_COMPANIES', '100'))  # Maximum companies returned per search
+
+# Google Text Search pagination: up to 3 pages of 20; a next_page_token only works after a short delay
+GOOGLE_MAX_PAGES = int(os.environ.get('GOOGLE_MAX_PAGES', '3'))
+NEXT_PAGE_TOKEN_DELAY = 2.0  # Seconds before a next_page_token becomes valid
+NEXT_PAGE_TOKEN_RETRIES = 3  # Extra tries when the token is still not ready (INVALID_REQUEST)
+
+# Apollo pagination: pages are requested a few at a time (still within the Apollo rate limit)
+APOLLO_PER_PAGE = int(os.environ.get('APOLLO_PER_PAGE', '25'))
+APOLLO_MAX_PAGES = int(os.environ.get('APOLLO_MAX_PAGES', '10'))
+APOLLO_PAGE_CONCURRENCY = int(os.environ.get('APOLLO_PAGE_CONCURRENCY', '3'))
+
+DEFAULT_SEARCH_REGION = 'North America'  # Region every provider searches unless the search names one
+BBOX_TEXT_LOCATIONS = 2  # Text searches cover a bounding box through this many of its largest metros
+
+# Nearby search tiling: the region is cut into tiles queried in parallel (Nearby Search radius is at most 50 km)
+NEARBY_MAX_TILES = int(os.environ.get('NEARBY_MAX_TILES', '40'))  # Nearby Search requests per search
+NEARBY_TILE_WORKERS = int(os.environ.get('NEARBY_TILE_WORKERS', '8'))
+NEARBY_MAX_RADIUS_M = 50000
+NEARBY_MIN_RADIUS_M = 2000  # Saturated tiles are not split below this radius
+NEARBY_PAGE_SIZE = 20  # A tile returning a full page probably has more places - split it
+NEARBY_SPARSE_SHARE = 0.25  # Share of tiles spent on the space between metro areas while metro tiles remain
+NEARBY_CANDIDATE_FACTOR = 2  # Stop querying tiles once there are this many candidates per wanted company
+
+# Search result cache: fresh for SEARCH_CACHE_TTL, then served stale (while refreshing) for SEARCH_CACHE_STALE_TTL
+SEARCH_CACHE_TTL = int(os.environ.get('SEARCH_CACHE_TTL', str(24 * 3600)))
+SEARCH_CACHE_STALE_TTL = int(os.environ.get('SEARCH_CACHE_STALE_TTL', str(7 * 24 * 3600)))
+SEARCH_CACHE_MEMORY_ITEMS = int(os.environ.get('SEARCH_CACHE_MEMORY_ITEMS', '50'))
+SEARCH_CACHE_DISK_BYTES = int(os.environ.get('SEARCH_CACHE_DISK_BYTES', str(100 * 1024 * 1024)))
+
+# Background search jobs
+SEARCH_WORKERS = int(os.environ.get('SEARCH_WORKERS', '4'))  # Searches running at the same time per process
+SEARCH_JOB_TTL = int(os.environ.get('SEARCH_JOB_TTL', '3600'))  # Seconds finished jobs are kept
+SEARCH_JOB_HEARTBEAT_INTERVAL = 30  # Seconds between "still here" writes for a worker's unfinished jobs
+SEARCH_JOB_LOST_AFTER = 4 * SEARCH_JOB_HEARTBEAT_INTERVAL  # Unfinished jobs without a heartbeat for this long died with their worker
+
+# Finished results are kept server-side so they can be exported by id
+RESULT_TTL = int(os.environ.get('RESULT_TTL', str(7 * 24 * 3600)))
+RESULT_DISK_BYTES = int(os.environ.get('RESULT_DISK_BYTES', str(200 * 1024 * 1024)))
+
+# Generated export files, reused for identical exports (the Render disk is 1 GB)
+EXPORT_CACHE_DIR = os.environ.get('EXPORT_CACHE_DIR', os.path.join('exports', 'cache'))
+EXPORT_CACHE_MAX_BYTES = int(os.environ.get('EXPORT_CACHE_MAX_BYTES', str(300 * 1024 * 1024)))
+EXPORT_PARTIAL_MAX_AGE = 600  # Seconds after which an unfinished export file is left over from a dead worker
+
+# HTTP connection pools - one keep-alive pool per provider
+HTTP_POOL_SIZES = {
+    'google': int(os.environ.get('HTTP_POOL_SIZE_GOOGLE', '20')),
+    'yelp': int(os.environ.get('HTTP_POOL_SIZE_YELP', '10')),
+    'apollo': int(os.environ.get('HTTP_POOL_SIZE_APOLLO', '5')),
+    'web': int(os.environ.get('HTTP_POOL_SIZE_WEB', '20')),  # company websites (contact pages)
+}
+HTTP_MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', '3'))
+HTTP_BACKOFF_FACTOR = float(os.environ.get('HTTP_BACKOFF_FACTOR', '0.5'))
+HTTP_BACKOFF_JITTER = float(os.environ.get('HTTP_BACKOFF_JITTER', '0.5'))
+
+# Place details cache (phone, website, email per place_id)
+PLACE_DETAILS_CACHE_TTL = int(os.environ.get('PLACE_DETAILS_CACHE_TTL', str(7 * 24 * 3600)))
+PLACE_DETAILS_CACHE_MEMORY_ITEMS = int(os.environ.get('PLACE_DETAILS_CACHE_MEMORY_ITEMS', '2000'))
+PLACE_DETAILS_CACHE_DISK_ITEMS = int(os.environ.get('PLACE_DETAILS_CACHE_DISK_ITEMS', '100000'))
+
+# Website email cache per registrable domain; "no email found" is cached for a shorter time
+EMAIL_CACHE_TTL = int(os.environ.get('EMAIL_CACHE_TTL', str(30 * 24 * 3600)))
+EMAIL_CACHE_NEGATIVE_TTL = int(os.environ.get('EMAIL_CACHE_NEGATIVE_TTL', str(3 * 24 * 3600)))
+EMAIL_CACHE_MEMORY_ITEMS = int(os.environ.get('EMAIL_CACHE_MEMORY_ITEMS', '5000'))
+EMAIL_CACHE_DISK_ITEMS = int(os.environ.get('EMAIL_CACHE_DISK_ITEMS', '200000'))
+
+# Contact page scanning - stop reading a page after this many bytes
+CONTACT_PAGE_MAX_BYTES = int(os.environ.get('CONTACT_PAGE_MAX_BYTES', str(512 * 1024)))
+CONTACT_PAGE_CHUNK_SIZE = 16 * 1024
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Per-provider token buckets shared by all workers: (requests per second, burst size)
+RATE_LIMITS = {
+    'google': (float(os.environ.get('RATE_LIMIT_GOOGLE', '10')), int(os.environ.get('RATE_LIMIT_GOOGLE_BURST', '20'))),
+    'yelp': (float(os.environ.get('RATE_LIMIT_YELP', '5')), int(os.environ.get('RATE_LIMIT_YELP_BURST', '10'))),
+    'apollo': (float(os.environ.get('RATE_LIMIT_APOLLO', '2')), int(os.environ.get('RATE_LIMIT_APOLLO_BURST', '2'))),
+}
+RATE_LIMIT_MIN_FACTOR = 0.1  # A throttled provider never drops below this share of its rate
+RATE_LIMIT_RECOVERY_SECONDS = float(os.environ.get('RATE_LIMIT_RECOVERY_SECONDS', '60'))  # Time to recover full rate after throttling
+
+class RateLimiter:
+    """Token bucket for one provider, kept in SQLite so all workers share it.
+    
+    Callers reserve a token and sleep until it is due, so bursts are spread out
+    instead of rejected. penalize() (on 429 / OVER_QUERY_LIMIT) empties the bucket
+    and halves the rate; the rate climbs back over RATE_LIMIT_RECOVERY_SECONDS.
+    """
+    
+    def __init__(self, provider, rate, burst):
+        self.provider = provider
+        self.rate = rate
+        self.burst = burst
+        self.table_ready = False
+    
+    def _db(self):
+        conn = get_db()
+        if not self.table_ready:
+            conn.execute('''CREATE TABLE IF NOT EXISTS rate_limits (
+                provider TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                factor REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )''')
+            self.table_ready = True
+        return conn
+    
+    def _update(self, change):
+        """Refill the bucket, apply change(tokens, factor) -> (tokens, factor) and save it atomically"""
+        conn = self._db()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            now = time.time()
+            row = conn.execute('SELECT tokens, factor, updated_at FROM rate_limits WHERE provider = ?', (self.provider,)).fetchone()
+            if row is None:
+                tokens, factor = float(self.burst), 1.0
+            else:
+                tokens, factor, updated_at = row
+                elapsed = max(now - updated_at, 0)
+                factor = min(1.0, factor + elapsed / RATE_LIMIT_RECOVERY_SECONDS)
+                tokens = min(float(self.burst), tokens + elapsed * self.rate * factor)
+            tokens, factor = change(tokens, factor)
+            conn.execute('INSERT OR REPLACE INTO rate_limits (provider, tokens, factor, updated_at) VALUES (?, ?, ?, ?)',
+                         (self.provider, tokens, factor, now))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return tokens, factor
+    
+    def acquire(self):
+        """Take a token, sleeping until it is available"""
+        try:
+            tokens, factor = self._update(lambda tokens, factor: (tokens - 1, factor))
+        except sqlite3.Error as e:
+            print(f"Rate limiter for {self.provider} unavailable, not waiting: {e}")
+            return
+        if tokens < 0:
+            delay = -tokens / (self.rate * factor)
+            if delay > time_remaining():
+                # The token won't come due before the deadline - give it back for other searches
+                self.release()
+                raise DeadlineExceeded('Search deadline would pass while waiting for the rate limiter')
+            time.sleep(delay)
+    
+    def release(self):
+        """Return a token that was taken but not used"""
+        try:
+            self._update(lambda tokens, factor: (min(float(self.burst), tokens + 1), factor))
+        except sqlite3.Error as e:
+            print(f"Rate limiter for {self.provider} unavailable: {e}")
+    
+    def penalize(self):
+        """Back off after the provider said we are over quota"""
+        try:
+            tokens, factor = self._update(lambda tokens, factor: (min(tokens, 0.0), max(RATE_LIMIT_MIN_FACTOR, factor / 2)))
+        except sqlite3.Error as e:
+            print(f"Rate limiter for {self.provider} unavailable: {e}")
+            return
+        print(f"Rate limit hit for {self.provider}, slowing down to {self.rate * factor:.2f} requests/s")
+
+rate_limiters = {provider: RateLimiter(provider, rate, burst) for provider, (rate, burst) in RATE_LIMITS.items()}
+
+class ProviderSession(requests.Session):
+    """Session that keeps requests inside the current deadline and its provider's rate limit.
+    
+    Each request's timeout is capped at the time left, and no request starts
+    once the deadline has passed.
+    """
+    
+    def __init__(self, limiter=None):
+        super().__init__()
+        self.limiter = limiter
+    
+    def request(self, *args, **kwargs):
+        check_deadline()
+        if self.limiter is None:
+            kwargs['timeout'] = request_timeout(kwargs.get('timeout'))
+            return super().request(*args, **kwargs)
+        
+        self.limiter.acquire()
+        kwargs['timeout'] = request_timeout(kwargs.get('timeout'))
+        response = super().request(*args, **kwargs)
+        # 429s retried away by urllib3 still count
+        retries = getattr(response.raw, 'retries', None)
+        if response.status_code == 429 or any(attempt.status == 429 for attempt in getattr(retries, 'history', ())):
+            self.limiter.penalize()
+        return response
+
+class DeadlineRetry(Retry):
+    """Retry policy that doesn't back off past the current deadline"""
+    
+    def sleep(self, response=None):
+        delay = None
+        if self.respect_retry_after_header and response:
+            delay = self.get_retry_after(response)
+        if delay is None:
+            delay = self.get_backoff_time()
+        if delay >= time_remaining():
+            # The retry could only start after the deadline
+            raise DeadlineExceeded('Search deadline would pass during retry backoff')
+        if delay > 0:
+            time.sleep(delay)
+
+http_sessions = {}
+http_sessions_lock = Lock()
+
+def create_http_session(provider):
+    """Create a session with a keep-alive connection pool and retry policy for a provider"""
+    pool_size = HTTP_POOL_SIZES.get(provider, 10)
+    # Company websites are crawled best-effort, so don't spend time retrying them
+    max_retries = 1 if provider == 'web' else HTTP_MAX_RETRIES
+    retry = DeadlineRetry(
+        total=max_retries,
+        backoff_factor=HTTP_BACKOFF_FACTOR,
+        backoff_jitter=HTTP_BACKOFF_JITTER,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=None,  # Apollo searches are POSTs but safe to repeat
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    
+    session = ProviderSession(rate_limiters.get(provider))
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    if provider == 'web':
+        session.headers['User-Agent'] = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+    return session
+
+def get_http_session(provider):
+    """Get the shared session for a provider ('google', 'yelp', 'apollo' or 'web')"""
+    session = http_sessions.get(provider)
+    if session is None:
+        with http_sessions_lock:
+            session = http_sessions.get(provider)
+            if session is None:
+                session = create_http_session(provider)
+                http_sessions[provider] = session
+    return session
+
+def google_places_get(url, params, timeout=10):
+    """Call a Google Places endpoint, retrying OVER_QUERY_LIMIT answers with jittered backoff"""
+    session = get_http_session('google')
+    for attempt in range(HTTP_MAX_RETRIES + 1):
+        response = session.get(url, params=params, timeout=timeout)
+        data = response.json()
+        if data.get('status') != 'OVER_QUERY_LIMIT':
+            return data
+        # Google reports quota errors with a 200, so tell the limiter ourselves
+        session.limiter.penalize()
+        delay = HTTP_BACKOFF_FACTOR * (2 ** attempt) + random.uniform(0, HTTP_BACKOFF_JITTER)
+        if attempt == HTTP_MAX_RETRIES or delay >= time_remaining():
+            return data
+        time.sleep(delay)
+    return data
+
 # Business types to EXCLUDE (retail stores, small shops, etc.)
 EXCLUDED_TYPES = [
     'restaurant', 'cafe', 'coffee_shop', 'bakery', 'food',
@@ -140,6 +968,32 @@ TRANSPORTATION_KEYWORDS = [
     'import', 'export', 'trucking', 'delivery'
 ]
 
+# Name words that mark small retail stores
+RETAIL_INDICATORS = ['store', 'shop', 'retail', 'outlet', 'mall']
+
+def keyword_pattern(keywords):
+    """One regex matching any of the keywords as a substring"""
+    return re.compile('|'.join(re.escape(keyword) for keyword in keywords))
+
+# The rules above, compiled once: sets for exact type matches, one regex per substring rule
+EXCLUDED_TYPE_SET = frozenset(EXCLUDED_TYPES)
+PRIORITY_TYPE_SET = frozenset(PRIORITY_TYPES)
+GENERIC_TYPE_SET = frozenset({'establishment', 'point_of_interest'})
+EXCLUDED_TYPE_PATTERN = keyword_pattern(EXCLUDED_TYPES)
+PRIORITY_TYPE_PATTERN = keyword_pattern(PRIORITY_TYPES)
+GENERIC_TYPE_PATTERN = keyword_pattern(GENERIC_TYPE_SET)
+TRANSPORTATION_KEYWORD_PATTERN = keyword_pattern(TRANSPORTATION_KEYWORDS)
+RETAIL_INDICATOR_PATTERN = keyword_pattern(RETAIL_INDICATORS)
+RETAIL_EXCEPTION_PATTERN = keyword_pattern(['wholesale', 'distribution'])
+
+def has_type(types, type_set, type_pattern):
+    """Whether any of the given types is in `types` (a list, or a string matched by substring)"""
+    if isinstance(types, str):
+        return type_pattern.search(types) is not None
+    if isinstance(types, (list, tuple, set, frozenset)):
+        return not type_set.isdisjoint(types)
+    return any(t in types for t in type_set)
+
 def is_transportation_relevant_company(place_data, company_name='', address=''):
     """Check if a company is relevant for transportation services"""
     # Get business types from place data
@@ -147,252 +1001,661 @@ def is_transportation_relevant_company(place_data, company_name='', address=''):
     business_status = place_data.get('business_status', '')
     
     # Exclude if it's in excluded types
-    for excluded_type in EXCLUDED_TYPES:
-        if excluded_type in types:
-            return False
+    if has_type(types, EXCLUDED_TYPE_SET, EXCLUDED_TYPE_PATTERN):
+        return False
     
     # Check if it's a priority type
-    for priority_type in PRIORITY_TYPES:
-        if priority_type in types:
-            return True
+    if has_type(types, PRIORITY_TYPE_SET, PRIORITY_TYPE_PATTERN):
+        return True
     
     # Check company name and address for transportation keywords
     name_lower = company_name.lower()
-    address_lower = address.lower()
-    combined_text = f"{name_lower} {address_lower}"
-    
-    for keyword in TRANSPORTATION_KEYWORDS:
-        if keyword in combined_text:
-            return True
-    
-    # Exclude small retail stores (check for common retail indicators)
-    retail_indicators = ['store', 'shop', 'retail', 'outlet', 'mall']
-    if any(indicator in name_lower for indicator in retail_indicators):
-        # But allow if it's wholesale or distribution
-        if 'wholesale' not in name_lower and 'distribution' not in name_lower:
-            return False
+    if TRANSPORTATION_KEYWORD_PATTERN.search(f"{name_lower} {address.lower()}"):
+        return True
+    
+    # Exclude small retail stores, but allow if it's wholesale or distribution
+    if RETAIL_INDICATOR_PATTERN.search(name_lower) and not RETAIL_EXCEPTION_PATTERN.search(name_lower):
+        return False
     
     # If business status is not operational, exclude
     if business_status and business_status != 'OPERATIONAL':
         return False
     
     # Default: include if it's a business establishment
-    return 'establishment' in types or 'point_of_interest' in types
+    return has_type(types, GENERIC_TYPE_SET, GENERIC_TYPE_PATTERN)
+
+def classify_places(places):
+    """One relevance flag per place in a page of Google Places results.
+    
+    A convenience over is_transportation_relevant_company; it is not faster per
+    place, since each place's search already stops at its first keyword.
+    """
+    classify = is_transportation_relevant_company
+    return [classify(place, place.get('name', ''), place.get('formatted_address', '')) for place in places]
+
+# Lead scoring - each candidate becomes a feature vector, scored as a batch and ranked
+LEAD_SCORE_THRESHOLD = float(os.environ.get('LEAD_SCORE_THRESHOLD', '0'))  # Candidates scoring below this are dropped
+LEAD_SCORE_FEATURES = (
+    'priority_types',  # Priority business types matched (up to 3)
+    'keyword_hits',    # Transportation keywords in name and address (up to 3)
+    'rating',          # Rating out of 5, scaled to 0-1
+    'employees',       # log10 of the employee count, 10,000+ = 1
+    'revenue',         # log10 of annual revenue, $1B+ = 1
+    'has_phone',
+    'has_website',
+    'has_email',
+    'excluded_type',   # Matches an excluded business type
+    'query_matches',   # Extra query variants that also returned it (up to 2, scaled to 0-1)
+)
+LEAD_SCORE_WEIGHTS = np.array([2.0, 1.0, 1.0, 1.0, 1.0, 0.5, 0.75, 1.0, -10.0, 1.5])
+AMOUNT_PATTERN = re.compile(r'([\d.]+)\s*([kmb])?', re.IGNORECASE)
+AMOUNT_MULTIPLIERS = {'k': 1e3, 'm': 1e6, 'b': 1e9}
+
+def parse_amount(value):
+    """Parse a count or amount like 250, '1,200' or '$12.5M' into a float (0 if unknown)"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return max(float(value), 0.0)
+    match = AMOUNT_PATTERN.search(str(value or '').replace(',', ''))
+    if not match:
+        return 0.0
+    try:
+        amount = float(match.group(1))
+    except ValueError:
+        return 0.0
+    return amount * AMOUNT_MULTIPLIERS.get((match.group(2) or '').lower(), 1)
+
+def count_types(types, type_set, type_pattern):
+    """How many of the given types are in `types` (a list, or a string matched by substring)"""
+    if isinstance(types, str):
+        return len(set(type_pattern.findall(types)))
+    if isinstance(types, (list, tuple, set, frozenset)):
+        return len(type_set.intersection(types))
+    return 0
+
+def lead_features(candidates):
+    """Feature matrix (one row per candidate, columns as LEAD_SCORE_FEATURES).
+    
+    Works on raw Places results and on finished company records alike.
+    """
+    raw = np.zeros((len(candidates), len(LEAD_SCORE_FEATURES)))
+    for row, candidate in zip(raw, candidates):
+        types = candidate.get('types') or candidate.get('business_type') or ''
+        text = f"{candidate.get('name') or ''} {candidate.get('address') or candidate.get('formatted_address') or ''}".lower()
+        row[0] = count_types(types, PRIORITY_TYPE_SET, PRIORITY_TYPE_PATTERN)
+        row[1] = len(set(TRANSPORTATION_KEYWORD_PATTERN.findall(text)))
+        row[2] = parse_amount(candidate.get('rating'))
+        row[3] = parse_amount(candidate.get('employee_count'))
+        row[4] = parse_amount(candidate.get('revenue'))
+        row[5] = bool(candidate.get('phone') or candidate.get('formatted_phone_number') or candidate.get('international_phone_number'))
+        row[6] = bool(candidate.get('website'))
+        row[7] = bool(candidate.get('email'))
+        row[8] = count_types(types, EXCLUDED_TYPE_SET, EXCLUDED_TYPE_PATTERN) > 0
+        row[9] = candidate.get('query_matches', 1)
+    
+    # Scale whole columns at once
+    features = raw.copy()
+    features[:, 0:2] = np.minimum(raw[:, 0:2], 3)
+    features[:, 2] = np.clip(raw[:, 2], 0, 5) / 5
+    features[:, 3] = np.minimum(np.log10(1 + raw[:, 3]) / 4, 1)
+    features[:, 4] = np.minimum(np.log10(1 + raw[:, 4]) / 9, 1)
+    features[:, 9] = np.clip(raw[:, 9] - 1, 0, 2) / 2
+    return features
+
+def score_candidates(candidates):
+    """Lead score of every candidate, computed as one matrix product"""
+    if not candidates:
+        return np.zeros(0)
+    return lead_features(candidates) @ LEAD_SCORE_WEIGHTS
 
-def search_google_places(industry, location, max_results=50, search_context='', timeout_seconds=25):
-    """Search for companies using Google Places API with progress tracking"""
+def rank_candidates(candidates, limit=None, threshold=None):
+    """Candidates sorted by lead score (best first, ties keep their order), without those below the threshold"""
+    if threshold is None:
+        threshold = LEAD_SCORE_THRESHOLD
+    scores = score_candidates(candidates)
+    order = np.argsort(-scores, kind='stable')
+    order = order[scores[order] >= threshold]
+    return [candidates[i] for i in order[:limit]]
+
+def text_search_page(query, loc, progress_count=0, page_token=None):
+    """Run one Google Places Text Search request.
+    
+    Returns (results, next_page_token); ([], None) on errors. With page_token,
+    fetches the following page of an earlier search (query is then ignored).
+    """
+    url = "https://maps.googleapis.com/maps/api/place/textsearch/json"
+    if page_token:
+        params = {'pagetoken': page_token, 'key': GOOGLE_PLACES_API_KEY}
+    else:
+        params = {
+            'query': query,
+            'key': GOOGLE_PLACES_API_KEY,
+            'type': 'establishment'
+        }
+    
+    try:
+        data = google_places_get(url, params, timeout=10)
+    except requests.Timeout:
+        update_progress('warning', 'timeout', progress_count, f'Timeout searching {loc}, skipping...')
+        return [], None
+    
+    if data.get('status') == 'OK':
+        return data.get('results', []), data.get('next_page_token')
+    if data.get('status') == 'ZERO_RESULTS':
+        return [], None
+    if data.get('status') == 'INVALID_REQUEST' and page_token:
+        # The token is not active yet - the caller tries again a little later
+        return None, page_token
+    if data.get('status') == 'OVER_QUERY_LIMIT':
+        update_progress('error', 'quota', progress_count, f'API quota exceeded for {loc}')
+    elif data.get('status') == 'REQUEST_DENIED':
+        update_progress('error', 'denied', progress_count, f'Request denied for {loc}: {data.get("error_message", "")}')
+    return [], None
+
+def text_search_places(query, loc, progress_count=0):
+    """Run one Google Places Text Search and return its first page of results ([] on errors)"""
+    return text_search_page(query, loc, progress_count)[0]
+
+def place_to_company(place, company_details, loc, industry_field):
+    """Build a company record from a Places search result and its looked-up details"""
+    return {
+        'name': place.get('name', ''),
+        'address': place.get('formatted_address') or place.get('vicinity', ''),  # Nearby Search only has a vicinity
+        'phone': company_details.get('phone', place.get('formatted_phone_number', '')),
+        'email': company_details.get('email', ''),
+        'website': company_details.get('website', place.get('website', '')),
+        'rating': place.get('rating', ''),
+        'country': company_details.get('country') or loc,  # From the place's address when known
+        'industry': industry_field,
+        'place_id': place.get('place_id', ''),
+        'business_type': ', '.join([t for t in place.get('types', []) if t not in ['point_of_interest', 'establishment']][:3])
+    }
+
+def search_google_places(industry, location, max_results=50, search_context=''):
+    """Search for companies using Google Places API with progress tracking, within the search deadline.
+    
+    Follows next_page_token for up to GOOGLE_MAX_PAGES pages per location. Each
+    page's best candidates go to the detail-lookup pool as soon as the page
+    arrives, and finished lookups are published while the next page token
+    activates. Paging stops once the location has its share of companies.
+    """
     companies = []
-    start_time = time.time()
     
     if not GOOGLE_PLACES_API_KEY:
         return companies
     
     try:
-        # Reduce max_results to avoid timeout (Render free tier has 30s limit)
-        max_results = min(max_results, 30)  # Limit to 30 to stay under timeout
-        
-        # Search in multiple locations
-        locations = ['Canada', 'United States']
-        results_per_location = max_results // 2
-        
-        update_progress('searching', f'Searching Google Places in {locations[0]}...', len(companies))
+        region = parse_region(location)
+    except ValueError as e:
+        print(f"Google Places search: {e}")
+        return companies
+    
+    # Determine industry field based on search context
+    industry_field = search_context if search_context else industry
+    lookups = {}  # Future -> (place, country) for detail lookups still running
+    seen_place_ids = set()
+    
+    def collect(timeout):
+        """Turn finished detail lookups into companies, waiting up to timeout for the first"""
+        if not lookups:
+            return
+        done, _ = wait(lookups, timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            place, country = lookups.pop(future)
+            try:
+                company_details = future.result()
+            except Exception as e:
+                print(f"Error fetching place details: {e}")
+                company_details = {}
+            if len(companies) >= max_results:
+                continue
+            if not region.contains(company_details.get('country'), company_details.get('state')):
+                continue
+            company = place_to_company(place, company_details, country, industry_field)
+            companies.append(company)
+            publish_company(company)
+            update_progress('found', f'Found: {company["name"][:40]}...', len(companies))
+    
+    def wait_until(ready_at):
+        """Wait for a page token to activate, publishing finished lookups meanwhile"""
+        while time.time() < ready_at and time_remaining() > 0:
+            if lookups:
+                collect(min(ready_at - time.time(), time_remaining()))
+            else:
+                time.sleep(max(0, min(ready_at - time.time(), time_remaining())))
+    
+    executor = ThreadPoolExecutor(max_workers=DETAILS_MAX_WORKERS, thread_name_prefix='place-details')
+    try:
+        # Search each of the region's locations
+        locations = region.locations
+        if locations:
+            update_progress('searching', f'Searching Google Places in {locations[0][0]}...', len(companies))
         
-        for idx, loc in enumerate(locations):
+        for idx, (loc, country) in enumerate(locations):
             query = f"{industry} companies in {loc}" if not search_context else f"{industry} in {loc}"
             update_progress('searching', f'Searching {loc}... ({idx+1}/{len(locations)})', len(companies), f'Query: {query}')
             
-            # Use Text Search API with timeout
-            url = "https://maps.googleapis.com/maps/api/place/textsearch/json"
-            params = {
-                'query': query,
-                'key': GOOGLE_PLACES_API_KEY,
-                'type': 'establishment'
-            }
-            
-            try:
-                response = requests.get(url, params=params, timeout=10)
-                data = response.json()
-            except requests.Timeout:
-                update_progress('warning', 'timeout', len(companies), f'Timeout searching {loc}, skipping...')
-                continue
-            
-            if data.get('status') == 'OK':
-                places = data.get('results', [])[:results_per_location]
-                update_progress('processing', f'Processing {len(places)} results from {loc}...', len(companies))
+            # This location's share of what is still missing
+            quota = (max_results - len(companies) - len(lookups)) // (len(locations) - idx)
+            accepted = 0
+            page_token = None
+            for page in range(GOOGLE_MAX_PAGES):
+                if accepted >= quota:
+                    break
+                # Check the deadline before every page
+                if time_remaining() <= 0:
+                    print("Search deadline reached, stopping Google Places search")
+                    update_progress('warning', 'timeout', len(companies), 'Stopping search: time budget used up')
+                    break
                 
-                # Check timeout before processing places
-                elapsed_total = time.time() - start_time
-                if elapsed_total > timeout_seconds:
-                    print(f"Timeout warning: {elapsed_total:.1f}s elapsed, stopping search")
-                    update_progress('warning', 'timeout', len(companies), f'Stopping search to avoid timeout ({elapsed_total:.1f}s)')
+                places, next_token = text_search_page(query, loc, len(companies), page_token)
+                for retry in range(NEXT_PAGE_TOKEN_RETRIES):
+                    if places is not None:
+                        break
+                    wait_until(time.time() + NEXT_PAGE_TOKEN_DELAY / 2)
+                    places, next_token = text_search_page(query, loc, len(companies), page_token)
+                if not places:
                     break
+                token_ready_at = time.time() + NEXT_PAGE_TOKEN_DELAY
+                update_progress('processing', f'Processing {len(places)} results from {loc} (page {page + 1})...', len(companies))
                 
-                # Limit places to process to avoid timeout
-                places_to_process = min(len(places), 15)  # Process max 15 per location
+                # Filter out retail stores and small shops, then send the best of the page for details
+                places = [place for place in places if place.get('place_id') not in seen_place_ids]
+                candidates = [place for place, relevant in zip(places, classify_places(places)) if relevant]
+                candidates = rank_candidates(candidates, limit=quota - accepted)
+                for place in candidates:
+                    seen_place_ids.add(place.get('place_id'))
+                    lookups[submit_in_context(executor, get_place_details, place.get('place_id', ''), 2)] = (place, country)
+                accepted += len(candidates)
+                update_progress('processing', f'Fetching details for {len(candidates)} companies in {loc}...', len(companies))
                 
-                for place_idx, place in enumerate(places[:places_to_process]):
-                    # Check timeout during processing
-                    if time.time() - start_time > timeout_seconds:
-                        print(f"Timeout during processing, stopping at {place_idx}/{places_to_process}")
-                        break
-                    
-                    # Filter out retail stores and small shops
-                    if not is_transportation_relevant_company(
-                        place, 
-                        place.get('name', ''), 
-                        place.get('formatted_address', '')
-                    ):
-                        continue
-                    
-                    place_id = place.get('place_id', '')
-                    company_name = place.get('name', '')
-                    
-                    # Skip detail fetching to save time - use data from search results
-                    # This is the main bottleneck causing timeout
-                    update_progress('processing', f'Processing: {company_name[:40]}...', len(companies))
-                    
-                    # Use data from search results directly (faster)
-                    # Only fetch details if we have time
-                    company_details = {}
-                    if time.time() - start_time < timeout_seconds - 3:  # Leave 3s buffer
-                        try:
-                            company_details = get_place_details(place_id, timeout=2)  # Reduced timeout
-                        except:
-                            pass  # Use basic data if details fail
-                    
-                    # Determine industry field based on search context
-                    industry_field = search_context if search_context else industry
-                    
-                    company = {
-                        'name': company_name,
-                        'address': place.get('formatted_address', ''),
-                        'phone': company_details.get('phone', place.get('formatted_phone_number', '')),
-                        'email': company_details.get('email', ''),
-                        'website': company_details.get('website', place.get('website', '')),
-                        'rating': place.get('rating', ''),
-                        'country': loc,
-                        'industry': industry_field,
-                        'place_id': place_id,
-                        'business_type': ', '.join([t for t in place.get('types', []) if t not in ['point_of_interest', 'establishment']][:3])
-                    }
-                    companies.append(company)
-                    update_progress('found', f'Found: {company_name[:40]}...', len(companies))
-                    
-                    # Early return if we have enough companies
-                    if len(companies) >= 20:  # Return early with 20 companies
-                        print(f"Found enough companies ({len(companies)}), returning early")
-                        break
-            
-            elif data.get('status') == 'OVER_QUERY_LIMIT':
-                update_progress('error', 'quota', len(companies), f'API quota exceeded for {loc}')
-            elif data.get('status') == 'REQUEST_DENIED':
-                update_progress('error', 'denied', len(companies), f'Request denied for {loc}: {data.get("error_message", "")}')
-            
-            time.sleep(0.2)  # Rate limiting
-            
+                if not next_token or accepted >= quota:
+                    break
+                page_token = next_token
+                wait_until(token_ready_at)
+        
+    except DeadlineExceeded:
+        update_progress('warning', 'timeout', len(companies), 'Stopping search: time budget used up')
     except Exception as e:
         update_progress('error', 'exception', len(companies), f'Error: {str(e)[:50]}')
     
+    try:
+        # Finish the lookups still running, within the search deadline
+        while lookups and time_remaining() > 0:
+            collect(wait_budget())
+        if lookups:
+            # Places whose lookup missed the deadline keep the basic search data
+            update_progress('warning', 'timeout', len(companies), f'Time budget reached, {len(lookups)} companies kept without details')
+            for place, country in lookups.values():
+                company = place_to_company(place, {}, country, industry_field)
+                companies.append(company)
+                publish_company(company)
+            lookups.clear()
+    finally:
+        # Don't wait for lookups that missed the deadline; queued ones are cancelled
+        executor.shutdown(wait=False, cancel_futures=True)
+    
     update_progress('completed', 'Google Places search completed', len(companies), f'Found {len(companies)} companies')
     return companies
 
+def fetch_place_details_concurrently(place_ids, timeout=5):
+    """Fetch details for many places at once, dropping lookups still pending at the search deadline"""
+    results = {}
+    place_ids = [place_id for place_id in place_ids if place_id]
+    
+    time_budget = time_remaining()
+    if not place_ids or time_budget <= 0:
+        return results
+    
+    executor = ThreadPoolExecutor(max_workers=min(DETAILS_MAX_WORKERS, len(place_ids)), thread_name_prefix='place-details')
+    try:
+        futures = {submit_in_context(executor, get_place_details, place_id, timeout): place_id for place_id in place_ids}
+        done, pending = wait(futures, timeout=wait_budget())
+        
+        for future in done:
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                print(f"Error fetching place details: {e}")
+        
+        if pending:
+            update_progress('warning', 'timeout', detail=f'Time budget reached, dropped {len(pending)} pending detail lookups')
+    finally:
+        # Don't wait for lookups that missed the deadline; queued ones are cancelled
+        executor.shutdown(wait=False, cancel_futures=True)
+    
+    return results
+
+place_details_cache = TieredCache(
+    'place_details',
+    ttl=PLACE_DETAILS_CACHE_TTL,
+    max_memory_items=PLACE_DETAILS_CACHE_MEMORY_ITEMS,
+    max_disk_items=PLACE_DETAILS_CACHE_DISK_ITEMS
+)
+
+PLACE_DETAILS_CACHED_FIELDS = ('phone', 'website', 'country', 'state')
+
 def get_place_details(place_id, timeout=5):
     """Get detailed information about a place including contact info with timeout"""
     details = {
         'phone': '',
         'email': '',
-        'website': ''
+        'website': '',
+        'country': '',
+        'state': ''
     }
     
     if not place_id or not GOOGLE_PLACES_API_KEY:
         return details
     
+    # Only the place's own fields are cached here - the email comes from the
+    # per-domain cache, which keeps failed crawls for a shorter time
+    cached = place_details_cache.get(place_id)
+    if cached is not None:
+        details.update({field: cached.get(field, '') for field in PLACE_DETAILS_CACHED_FIELDS})
+        if details['website']:
+            try:
+                details['email'] = extract_email_from_website(details['website'])
+            except DeadlineExceeded:
+                pass  # Keep the cached phone and website without an email
+        return details
+    
     try:
         details_url = "https://maps.googleapis.com/maps/api/place/details/json"
         details_params = {
             'place_id': place_id,
             'key': GOOGLE_PLACES_API_KEY,
-            'fields': 'formatted_phone_number,international_phone_number,website,email,opening_hours'
+            'fields': 'formatted_phone_number,international_phone_number,website,email,opening_hours,address_components'
         }
         
         # Use timeout to prevent hanging - skip if takes more than 5 seconds
         start_time = time.time()
-        response = requests.get(details_url, params=details_params, timeout=timeout)
+        details_data = google_places_get(details_url, details_params, timeout=timeout)
         elapsed = time.time() - start_time
         
         if elapsed > 4.5:
             update_progress('warning', 'slow', detail=f'Slow API response ({elapsed:.1f}s)')
         
-        details_data = response.json()
-        
         if details_data.get('status') == 'OK':
             result = details_data.get('result', {})
             details['phone'] = result.get('formatted_phone_number', result.get('international_phone_number', ''))
             details['website'] = result.get('website', '')
+            for component in result.get('address_components', []):
+                if 'country' in component.get('types', []):
+                    details['country'] = component.get('long_name', '')
+                elif 'administrative_area_level_1' in component.get('types', []):
+                    details['state'] = component.get('long_name', '')
+            place_details_cache.set(place_id, {field: details[field] for field in PLACE_DETAILS_CACHED_FIELDS})
             
             # Google Places API doesn't provide email directly, so try to extract from website
             if details['website']:
-                email = extract_email_from_website(details['website'])
-                if email:
-                    details['email'] = email
-                else:
-                    details['email'] = ''
-            else:
-                details['email'] = ''
-        
-        time.sleep(0.1)  # Rate limiting
+                details['email'] = extract_email_from_website(details['website'])
         
     except requests.Timeout:
         update_progress('warning', 'timeout', detail=f'Timeout getting details (>{timeout}s), skipping...')
         return details
+    except DeadlineExceeded:
+        return details
     except Exception as e:
         update_progress('warning', 'error', detail=f'Error getting place details: {str(e)[:50]}')
     
     return details
 
+# Public suffixes with two labels, so "acme.co.uk" isn't treated as the domain "co.uk"
+MULTI_LABEL_SUFFIXES = {
+    'co.uk', 'org.uk', 'ac.uk', 'gov.uk', 'ltd.uk', 'plc.uk',
+    'com.au', 'net.au', 'org.au', 'co.nz', 'co.jp', 'co.in', 'co.za',
+    'com.br', 'com.mx', 'com.cn', 'com.hk', 'com.sg', 'com.tw', 'com.tr',
+    'ab.ca', 'bc.ca', 'mb.ca', 'nb.ca', 'nl.ca', 'ns.ca', 'on.ca', 'pe.ca', 'qc.ca', 'sk.ca',
+}
+
+def registrable_domain(url):
+    """Get the registrable domain of a URL (https://www.shop.acme.co.uk/x -> acme.co.uk)"""
+    if not url:
+        return ''
+    if '://' not in url:
+        url = f'http://{url}'
+    host = (urlparse(url).hostname or '').lower().rstrip('.')
+    if not host or re.fullmatch(r'[\d.]+', host):
+        return host
+    labels = host.split('.')
+    if len(labels) >= 3 and '.'.join(labels[-2:]) in MULTI_LABEL_SUFFIXES:
+        return '.'.join(labels[-3:])
+    return '.'.join(labels[-2:])
+
+email_domain_cache = TieredCache(
+    'website_emails',
+    ttl=EMAIL_CACHE_TTL,
+    max_memory_items=EMAIL_CACHE_MEMORY_ITEMS,
+    max_disk_items=EMAIL_CACHE_DISK_ITEMS
+)
+
+# Domains currently being crawled -> Future with the email, so concurrent lookups share one crawl
+email_lookups_in_flight = {}
+email_lookups_lock = Lock()
+
 def extract_email_from_website(url):
-    """Try to extract email from website contact page"""
+    """Try to extract email from website contact page, cached per domain"""
+    if not url or not url.startswith('http'):
+        return ''
+    
+    domain = registrable_domain(url)
+    if not domain:
+        return crawl_website_for_email(url)
+    
+    cached = email_domain_cache.get(domain)
+    if cached is not None:
+        return cached.get('email', '')
+    
+    with email_lookups_lock:
+        lookup = email_lookups_in_flight.get(domain)
+        is_owner = lookup is None
+        if is_owner:
+            lookup = Future()
+            email_lookups_in_flight[domain] = lookup
+    
+    if not is_owner:
+        # Another thread is already crawling this domain - wait for its answer
+        try:
+            return lookup.result(timeout=min(30, max(time_remaining(), 0)))
+        except Exception:
+            return ''
+    
+    email = ''
+    try:
+        email = crawl_website_for_email(url)
+        email_domain_cache.set(domain, {'email': email}, ttl=None if email else EMAIL_CACHE_NEGATIVE_TTL)
+    finally:
+        lookup.set_result(email)
+        with email_lookups_lock:
+            email_lookups_in_flight.pop(domain, None)
+    
+    return email
+
+EMAIL_PATTERN = re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b')
+# Common non-business emails, plus image names like logo@2x.png that look like emails
+EXCLUDED_EMAIL_PATTERN = re.compile(r'example\.com|test\.com|placeholder|noreply|no-reply|\.(?:png|jpe?g|gif|svg|webp)$', re.IGNORECASE)
+EMAIL_CHARS_PREFIX = re.compile(r'^[A-Za-z0-9._%+-]+')
+EMAIL_MAX_LENGTH = 254
+SCANNED_CONTENT_TYPES = ('text/html', 'application/xhtml+xml', 'text/plain')
+
+def find_business_email(text, final=True):
+    """Return the first email in text that isn't a known non-business address"""
+    for match in EMAIL_PATTERN.finditer(text):
+        # A match touching the end of a partial buffer may continue in the next chunk
+        if not final and match.end() == len(text):
+            continue
+        email = match.group(0)
+        if not EXCLUDED_EMAIL_PATTERN.search(email):
+            return email
+    return ''
+
+def iter_page_text(session, url, timeout=5, max_bytes=None):
+    """Stream an HTML page as decoded text chunks, stopping after max_bytes (nothing for non-HTML responses)"""
+    if max_bytes is None:
+        max_bytes = CONTACT_PAGE_MAX_BYTES
+    
+    with session.get(url, timeout=timeout, allow_redirects=True, stream=True) as response:
+        if response.status_code != 200:
+            return
+        
+        # Skip PDFs, images, downloads etc.
+        content_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        if content_type and content_type not in SCANNED_CONTENT_TYPES:
+            return
+        
+        try:
+            decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')(errors='replace')
+        except LookupError:
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        
+        bytes_read = 0
+        for chunk in response.iter_content(chunk_size=CONTACT_PAGE_CHUNK_SIZE):
+            # The read timeout applies per chunk, so a slow page could outlast the deadline
+            check_deadline()
+            bytes_read += len(chunk)
+            text = decoder.decode(chunk)
+            if text:
+                yield text
+            if bytes_read >= max_bytes:
+                return
+        
+        text = decoder.decode(b'', final=True)
+        if text:
+            yield text
+
+def scan_page_for_email(session, url, timeout=5, max_bytes=None):
+    """Stream a page in chunks and return the first business email, reading at most max_bytes"""
+    tail = ''
+    for chunk in iter_page_text(session, url, timeout, max_bytes):
+        text = tail + chunk
+        email = find_business_email(text, final=False)
+        if email:
+            return email
+        # Carry the end of the buffer over so emails split across chunks are still found,
+        # without the cut-off start of an earlier address
+        tail = EMAIL_CHARS_PREFIX.sub('', text[-(EMAIL_MAX_LENGTH + 2):])
+    
+    return find_business_email(tail)
+
+# Words that mark a link as a contact page, with how strongly they do
+CONTACT_LINK_KEYWORDS = {
+    'contact': 5, 'kontakt': 5, 'contacto': 5, 'nous-joindre': 5, 'joindre': 4,
+    'get in touch': 4, 'get-in-touch': 4, 'reach us': 3, 'inquir': 3, 'enquir': 3,
+    'quote': 2, 'sales': 2, 'support': 1, 'about': 1, 'locations': 1,
+}
+CONTACT_LINK_PATTERN = re.compile('|'.join(re.escape(keyword) for keyword in CONTACT_LINK_KEYWORDS))
+
+class ContactLinkParser(HTMLParser):
+    """Streaming tokenizer that collects mailto: addresses, text emails and contact-like links"""
+    
+    def __init__(self, base_url):
+        super().__init__(convert_charrefs=True)
+        self.base_url = base_url
+        self.site_domain = registrable_domain(base_url)
+        self.mailto_email = ''
+        self.text_email = ''
+        self.contact_links = {}  # url -> score
+        self.current_href = None
+        self.current_text = []
+    
+    def handle_starttag(self, tag, attrs):
+        if tag != 'a':
+            return
+        href = (dict(attrs).get('href') or '').strip()
+        
+        if href.lower().startswith('mailto:'):
+            email = unquote(href[7:].split('?')[0]).strip()
+            if not self.mailto_email and EMAIL_PATTERN.fullmatch(email) and not EXCLUDED_EMAIL_PATTERN.search(email):
+                self.mailto_email = email
+            return
+        
+        if href and not href.startswith(('#', 'javascript:', 'tel:')):
+            self.current_href = href
+            self.current_text = []
+    
+    def handle_data(self, data):
+        if self.current_href is not None:
+            self.current_text.append(data)
+        if not self.text_email and '@' in data:
+            self.text_email = find_business_email(data)
+    
+    def handle_endtag(self, tag):
+        if tag != 'a' or self.current_href is None:
+            return
+        href, self.current_href = self.current_href, None
+        
+        link = urljoin(self.base_url, href)
+        # Only follow links on the company's own site
+        if not link.startswith('http') or registrable_domain(link) != self.site_domain:
+            return
+        
+        # The link path counts double: "/contact-us" is a stronger signal than the anchor text
+        path = urlparse(link).path.lower()
+        text = ' '.join(self.current_text).lower()
+        score = sum(2 * CONTACT_LINK_KEYWORDS[m] for m in CONTACT_LINK_PATTERN.findall(path))
+        score += sum(CONTACT_LINK_KEYWORDS[m] for m in CONTACT_LINK_PATTERN.findall(text))
+        if score > self.contact_links.get(link, 0):
+            self.contact_links[link] = score
+    
+    def best_contact_link(self):
+        """The most likely contact page, or '' if no link looked like one"""
+        if not self.contact_links:
+            return ''
+        return max(self.contact_links.items(), key=lambda item: item[1])[0]
+
+def discover_contact_info(session, url, timeout=5):
+    """Read a homepage once and return (email, best contact page link)"""
+    parser = ContactLinkParser(url)
+    for chunk in iter_page_text(session, url, timeout):
+        parser.feed(chunk)
+        # A mailto: link is the best answer we can get - stop downloading
+        if parser.mailto_email:
+            return parser.mailto_email, ''
+    parser.close()
+    return parser.mailto_email or parser.text_email, parser.best_contact_link()
+
+def crawl_website_for_email(url):
+    """Find an email on a company website: homepage first, then its most likely contact page"""
     try:
         if not url or not url.startswith('http'):
             return ''
         
-        # Common contact page URLs
-        contact_urls = [
-            urljoin(url, '/contact'),
-            urljoin(url, '/contact-us'),
-            urljoin(url, '/contact.html'),
-            urljoin(url, '/about/contact'),
-        ]
-        
-        # Try to fetch contact page
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        }
+        # The shared session sends a browser User-Agent
+        session = get_http_session('web')
         
-        for contact_url in contact_urls[:2]:  # Limit to first 2 attempts
-            try:
-                response = requests.get(contact_url, headers=headers, timeout=5, allow_redirects=True)
-                if response.status_code == 200:
-                    # Look for email patterns in the HTML
-                    email_pattern = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'
-                    emails = re.findall(email_pattern, response.text)
-                    
-                    # Filter out common non-business emails
-                    filtered_emails = [e for e in emails if not any(
-                        x in e.lower() for x in ['example.com', 'test.com', 'placeholder', 'noreply', 'no-reply']
-                    )]
-                    
-                    if filtered_emails:
-                        return filtered_emails[0]  # Return first valid email
-            except:
-                continue
+        contact_url = ''
+        try:
+            email, contact_url = discover_contact_info(session, url, timeout=5)
+            if email:
+                return email
+        except DeadlineExceeded:
+            raise
+        except Exception:
+            pass
+        
+        # Fall back to the usual contact page location if the homepage had no contact link
+        if not contact_url:
+            contact_url = urljoin(url, '/contact')
+        if contact_url.rstrip('/') == url.rstrip('/'):
+            return ''
         
-        return ''
+        try:
+            return scan_page_for_email(session, contact_url, timeout=5)
+        except DeadlineExceeded:
+            raise
+        except Exception:
+            return ''
         
+    except DeadlineExceeded:
+        # Unfinished, so don't let it be cached as "no email"
+        raise
     except Exception as e:
         print(f"Error extracting email: {e}")
         return ''
 
+# Yelp's country codes for the countries regions cover
+YELP_COUNTRIES = {'CA': 'Canada', 'US': 'United States'}
+
 def search_yelp(industry, location, max_results=50):
     """Search for companies using Yelp API"""
     companies = []
@@ -405,10 +1668,10 @@ def search_yelp(industry, location, max_results=50):
             'Authorization': f'Bearer {YELP_API_KEY}'
         }
         
-        locations = ['CA', 'US']
-        results_per_location = max_results // 2
+        locations = parse_region(location).locations
+        results_per_location = max_results // max(len(locations), 1)
         
-        for loc in locations:
+        for loc, country in locations:
             url = "https://api.yelp.com/v3/businesses/search"
             params = {
                 'term': industry,
@@ -417,7 +1680,7 @@ def search_yelp(industry, location, max_results=50):
                 'sort_by': 'rating'
             }
             
-            response = requests.get(url, headers=headers, params=params)
+            response = get_http_session('yelp').get(url, headers=headers, params=params, timeout=10)
             data = response.json()
             
             if 'businesses' in data:
@@ -433,13 +1696,12 @@ def search_yelp(industry, location, max_results=50):
                         'email': yelp_details.get('email', ''),
                         'website': business.get('url', '') or yelp_details.get('website', ''),
                         'rating': business.get('rating', ''),
-                        'country': 'Canada' if loc == 'CA' else 'United States',
+                        'country': YELP_COUNTRIES.get(business.get('location', {}).get('country'), country),
                         'industry': industry,
                         'place_id': business_id
                     }
                     companies.append(company)
-            
-            time.sleep(0.2)  # Rate limiting
+                    publish_company(company)
             
     except Exception as e:
         print(f"Error in Yelp search: {e}")
@@ -463,7 +1725,7 @@ def get_yelp_business_details(business_id):
             'Authorization': f'Bearer {YELP_API_KEY}'
         }
         
-        response = requests.get(url, headers=headers, timeout=10)
+        response = get_http_session('yelp').get(url, headers=headers, timeout=10)
         
         if response.status_code == 200:
             data = response.json()
@@ -471,112 +1733,423 @@ def get_yelp_business_details(business_id):
             details['website'] = data.get('url', '')
             # Yelp API doesn't provide email directly
         
-        time.sleep(0.1)  # Rate limiting
-        
     except Exception as e:
         print(f"Error getting Yelp business details: {e}")
     
     return details
 
+# Search regions as (south, west, north, east) boxes. Boxes are rectangles, so a country's
+# boxes also cover some of its neighbour; only the region's own metros get dense tiles
+# and places are checked against the region once their address is known.
+COUNTRY_REGIONS = {
+    'canada': [(41.7, -141.0, 83.1, -52.6)],
+    'united states': [
+        (24.4, -124.8, 49.4, -66.9),  # Contiguous states
+        (51.2, -179.1, 71.4, -129.9),  # Alaska
+        (18.9, -160.3, 22.3, -154.8),  # Hawaii
+    ],
+    # Both countries without overlapping boxes, so no area is tiled twice
+    'north america': [
+        (24.4, -124.8, 49.4, -52.6),  # Contiguous states and southern Canada
+        (49.4, -141.0, 83.1, -52.6),  # Rest of Canada (and the Alaska panhandle)
+        (51.2, -179.1, 71.4, -141.0),  # Alaska
+        (18.9, -160.3, 22.3, -154.8),  # Hawaii
+    ],
+}
+COUNTRY_NAMES = {'canada': ('Canada',), 'united states': ('United States',), 'north america': ('Canada', 'United States')}
+COUNTRY_ALIASES = {'usa': 'united states', 'us': 'united states'}
+
+PROVINCE_REGIONS = {
+    'alberta': (49.0, -120.0, 60.0, -110.0), 'british columbia': (48.3, -139.1, 60.0, -114.0),
+    'manitoba': (49.0, -102.0, 60.0, -88.9), 'new brunswick': (44.6, -69.1, 48.1, -63.8),
+    'newfoundland and labrador': (46.6, -67.8, 60.4, -52.6), 'nova scotia': (43.4, -66.3, 47.1, -59.7),
+    'ontario': (41.7, -95.2, 56.9, -74.3), 'prince edward island': (45.9, -64.4, 47.1, -62.0),
+    'quebec': (45.0, -79.8, 62.6, -57.1), 'saskatchewan': (49.0, -110.0, 60.0, -101.4),
+    'northwest territories': (60.0, -136.5, 78.8, -102.0), 'nunavut': (51.6, -120.7, 83.1, -61.2),
+    'yukon': (60.0, -141.0, 69.6, -123.8),
+}
+
+STATE_REGIONS = {
+    'alabama': (30.2, -88.5, 35.0, -84.9), 'alaska': (51.2, -179.1, 71.4, -129.9),
+    'arizona': (31.3, -114.8, 37.0, -109.0), 'arkansas': (33.0, -94.6, 36.5, -89.6),
+    'california': (32.5, -124.4, 42.0, -114.1), 'colorado': (37.0, -109.1, 41.0, -102.0),
+    'connecticut': (41.0, -73.7, 42.05, -71.8), 'delaware': (38.45, -75.8, 39.85, -75.05),
+    'district of columbia': (38.79, -77.12, 39.0, -76.91), 'florida': (24.4, -87.6, 31.0, -80.0),
+    'georgia': (30.4, -85.6, 35.0, -80.8), 'hawaii': (18.9, -160.3, 22.3, -154.8),
+    'idaho': (42.0, -117.2, 49.0, -111.0), 'illinois': (37.0, -91.5, 42.5, -87.0),
+    'indiana': (37.8, -88.1, 41.8, -84.8), 'iowa': (40.4, -96.6, 43.5, -90.1),
+    'kansas': (37.0, -102.05, 40.0, -94.6), 'kentucky': (36.5, -89.6, 39.15, -81.96),
+    'louisiana': (28.9, -94.05, 33.0, -88.8), 'maine': (43.0, -71.1, 47.5, -66.9),
+    'maryland': (37.9, -79.5, 39.7, -75.05), 'massachusetts': (41.2, -73.5, 42.9, -69.9),
+    'michigan': (41.7, -90.4, 48.3, -82.4), 'minnesota': (43.5, -97.2, 49.4, -89.5),
+    'mississippi': (30.2, -91.7, 35.0, -88.1), 'missouri': (36.0, -95.8, 40.6, -89.1),
+    'montana': (44.4, -116.05, 49.0, -104.04), 'nebraska': (40.0, -104.05, 43.0, -95.3),
+    'nevada': (35.0, -120.0, 42.0, -114.0), 'new hampshire': (42.7, -72.6, 45.3, -70.6),
+    'new jersey': (38.9, -75.6, 41.4, -73.9), 'new mexico': (31.3, -109.05, 37.0, -103.0),
+    'new york': (40.5, -79.8, 45.0, -71.85), 'north carolina': (33.8, -84.3, 36.6, -75.4),
+    'north dakota': (45.9, -104.05, 49.0, -96.55), 'ohio': (38.4, -84.8, 42.0, -80.5),
+    'oklahoma': (33.6, -103.0, 37.0, -94.4), 'oregon': (42.0, -124.6, 46.3, -116.5),
+    'pennsylvania': (39.7, -80.5, 42.3, -74.7), 'rhode island': (41.1, -71.9, 42.0, -71.1),
+    'south carolina': (32.0, -83.4, 35.2, -78.5), 'south dakota': (42.5, -104.06, 45.95, -96.4),
+    'tennessee': (35.0, -90.3, 36.7, -81.6), 'texas': (25.8, -106.65, 36.5, -93.5),
+    'utah': (37.0, -114.05, 42.0, -109.04), 'vermont': (42.7, -73.45, 45.0, -71.5),
+    'virginia': (36.5, -83.7, 39.5, -75.2), 'washington': (45.5, -124.8, 49.0, -116.9),
+    'west virginia': (37.2, -82.65, 40.64, -77.7), 'wisconsin': (42.5, -92.9, 47.1, -86.8),
+    'wyoming': (41.0, -111.06, 45.0, -104.05),
+}
+
+# Metro areas (name, lat, lng, population in millions, country, province/state) - the density
+# prior deciding where tiles go and how small they get
+METRO_ANCHORS = [
+    ('Toronto', 43.6532, -79.3832, 6.2, 'Canada', 'ontario'), ('Montreal', 45.5017, -73.5673, 4.3, 'Canada', 'quebec'),
+    ('Vancouver', 49.2827, -123.1207, 2.6, 'Canada', 'british columbia'), ('Calgary', 51.0447, -114.0719, 1.5, 'Canada', 'alberta'),
+    ('Edmonton', 53.5461, -113.4938, 1.4, 'Canada', 'alberta'), ('Ottawa', 45.4215, -75.6972, 1.5, 'Canada', 'ontario'),
+    ('Winnipeg', 49.8951, -97.1384, 0.85, 'Canada', 'manitoba'), ('Quebec City', 46.8139, -71.2080, 0.84, 'Canada', 'quebec'),
+    ('Hamilton', 43.2557, -79.8711, 0.8, 'Canada', 'ontario'), ('Kitchener', 43.4516, -80.4925, 0.6, 'Canada', 'ontario'),
+    ('London', 42.9849, -81.2453, 0.55, 'Canada', 'ontario'), ('Halifax', 44.6488, -63.5752, 0.47, 'Canada', 'nova scotia'),
+    ('Windsor', 42.3149, -83.0364, 0.42, 'Canada', 'ontario'), ('Saskatoon', 52.1332, -106.6700, 0.33, 'Canada', 'saskatchewan'),
+    ('Regina', 50.4452, -104.6189, 0.26, 'Canada', 'saskatchewan'),
+    ("St. John's", 47.5615, -52.7126, 0.21, 'Canada', 'newfoundland and labrador'),
+    ('New York', 40.7128, -74.0060, 19.5, 'United States', 'new york'), ('Los Angeles', 34.0522, -118.2437, 13.0, 'United States', 'california'),
+    ('Chicago', 41.8781, -87.6298, 9.4, 'United States', 'illinois'), ('Dallas', 32.7767, -96.7970, 7.9, 'United States', 'texas'),
+    ('Houston', 29.7604, -95.3698, 7.3, 'United States', 'texas'),
+    ('Washington', 38.9072, -77.0369, 6.3, 'United States', 'district of columbia'),
+    ('Philadelphia', 39.9526, -75.1652, 6.2, 'United States', 'pennsylvania'), ('Miami', 25.7617, -80.1918, 6.1, 'United States', 'florida'),
+    ('Atlanta', 33.7490, -84.3880, 6.2, 'United States', 'georgia'), ('Boston', 42.3601, -71.0589, 4.9, 'United States', 'massachusetts'),
+    ('Phoenix', 33.4484, -112.0740, 5.0, 'United States', 'arizona'), ('San Francisco', 37.7749, -122.4194, 4.6, 'United States', 'california'),
+    ('Riverside', 33.9533, -117.3962, 4.6, 'United States', 'california'), ('Detroit', 42.3314, -83.0458, 4.3, 'United States', 'michigan'),
+    ('Seattle', 47.6062, -122.3321, 4.0, 'United States', 'washington'), ('Minneapolis', 44.9778, -93.2650, 3.7, 'United States', 'minnesota'),
+    ('San Diego', 32.7157, -117.1611, 3.3, 'United States', 'california'), ('Tampa', 27.9506, -82.4572, 3.3, 'United States', 'florida'),
+    ('Denver', 39.7392, -104.9903, 3.0, 'United States', 'colorado'), ('Baltimore', 39.2904, -76.6122, 2.8, 'United States', 'maryland'),
+    ('St. Louis', 38.6270, -90.1994, 2.8, 'United States', 'missouri'), ('Charlotte', 35.2271, -80.8431, 2.7, 'United States', 'north carolina'),
+    ('Orlando', 28.5383, -81.3792, 2.7, 'United States', 'florida'), ('San Antonio', 29.4241, -98.4936, 2.6, 'United States', 'texas'),
+    ('Portland', 45.5152, -122.6784, 2.5, 'United States', 'oregon'), ('Sacramento', 38.5816, -121.4944, 2.4, 'United States', 'california'),
+    ('Pittsburgh', 40.4406, -79.9959, 2.4, 'United States', 'pennsylvania'), ('Austin', 30.2672, -97.7431, 2.4, 'United States', 'texas'),
+    ('Las Vegas', 36.1699, -115.1398, 2.3, 'United States', 'nevada'), ('Cincinnati', 39.1031, -84.5120, 2.3, 'United States', 'ohio'),
+    ('Kansas City', 39.0997, -94.5786, 2.2, 'United States', 'missouri'), ('Columbus', 39.9612, -82.9988, 2.1, 'United States', 'ohio'),
+    ('Indianapolis', 39.7684, -86.1581, 2.1, 'United States', 'indiana'), ('Cleveland', 41.4993, -81.6944, 2.1, 'United States', 'ohio'),
+    ('San Jose', 37.3382, -121.8863, 2.0, 'United States', 'california'), ('Nashville', 36.1627, -86.7816, 2.0, 'United States', 'tennessee'),
+    ('Virginia Beach', 36.8529, -76.0000, 1.8, 'United States', 'virginia'), ('Jacksonville', 30.3322, -81.6557, 1.6, 'United States', 'florida'),
+    ('Milwaukee', 43.0389, -87.9065, 1.6, 'United States', 'wisconsin'), ('Raleigh', 35.7796, -78.6382, 1.4, 'United States', 'north carolina'),
+    ('Oklahoma City', 35.4676, -97.5164, 1.4, 'United States', 'oklahoma'), ('Memphis', 35.1495, -90.0490, 1.3, 'United States', 'tennessee'),
+    ('Louisville', 38.2527, -85.7585, 1.3, 'United States', 'kentucky'), ('Salt Lake City', 40.7608, -111.8910, 1.3, 'United States', 'utah'),
+    ('New Orleans', 29.9511, -90.0715, 1.3, 'United States', 'louisiana'), ('Richmond', 37.5407, -77.4360, 1.3, 'United States', 'virginia'),
+    ('Buffalo', 42.8864, -78.8784, 1.2, 'United States', 'new york'), ('Birmingham', 33.5186, -86.8104, 1.1, 'United States', 'alabama'),
+    ('Honolulu', 21.3069, -157.8583, 1.0, 'United States', 'hawaii'), ('Omaha', 41.2565, -95.9345, 1.0, 'United States', 'nebraska'),
+    ('Tulsa', 36.1540, -95.9928, 1.0, 'United States', 'oklahoma'), ('Albuquerque', 35.0844, -106.6504, 0.9, 'United States', 'new mexico'),
+    ('El Paso', 31.7619, -106.4850, 0.87, 'United States', 'texas'), ('Boise', 43.6150, -116.2023, 0.8, 'United States', 'idaho'),
+    ('Anchorage', 61.2181, -149.9003, 0.4, 'United States', 'alaska'),
+]
+
+BBOX_PATTERN = re.compile(r'^bbox:\s*(-?[\d.]+)\s*,\s*(-?[\d.]+)\s*,\s*(-?[\d.]+)\s*,\s*(-?[\d.]+)$', re.IGNORECASE)
+
+def fold_accents(text):
+    """Casefold text and strip accents ('Québec' -> 'quebec')"""
+    folded = (text or '').casefold()
+    if folded.isascii():
+        return folded
+    return ''.join(char for char in unicodedata.normalize('NFKD', folded) if not unicodedata.combining(char))
+
+class SearchRegion:
+    """Where a search looks: boxes to tile, the metro anchors that belong to it,
+    the countries / province or state its places must be in, and the
+    (location text, country) pairs the text-based providers search"""
+    
+    def __init__(self, name, boxes, anchors, locations, countries=(), subdivision=''):
+        self.name = name
+        self.boxes = boxes
+        self.anchors = anchors
+        self.locations = locations
+        self.countries = countries  # Empty for bounding boxes, which can span a border
+        self.subdivision = subdivision  # Folded province/state name, or ''
+    
+    def contains(self, country, state):
+        """Whether an address with this country and province/state (as Place Details
+        names them) can be in the region; parts that are unknown don't rule it out"""
+        if self.countries and country and country not in self.countries:
+            return False
+        if self.subdivision and state and fold_accents(state) != self.subdivision:
+            return False
+        return True
+
+def parse_region(location):
+    """Turn a region spec into a SearchRegion.
+    
+    Accepts a country ('Canada', 'United States', 'North America'), a province
+    or state name, or an explicit box as 'bbox:south,west,north,east'.
+    """
+    spec = ' '.join(fold_accents(location).replace(',', ' , ').split()).replace(' , ', ', ')
+    match = BBOX_PATTERN.match(spec)
+    if match:
+        south, west, north, east = (float(value) for value in match.groups())
+        if not (-90 <= south < north <= 90 and -180 <= west < east <= 180):
+            raise ValueError(f'Invalid bounding box: {location}')
+        box = (south, west, north, east)
+        anchors = [anchor for anchor in METRO_ANCHORS if in_box(anchor, box)]
+        # Text searches can't take a box - search its largest metros by name instead
+        largest = sorted(anchors, key=lambda anchor: -anchor[3])[:BBOX_TEXT_LOCATIONS]
+        locations = [(f'{name}, {subdivision.title()}, {country}', country) for name, _, _, _, country, subdivision in largest]
+        return SearchRegion(location, [box], anchors, locations)
+    
+    name = spec.split(',')[0].strip()
+    name = COUNTRY_ALIASES.get(name, name)
+    if name in COUNTRY_REGIONS:
+        countries = COUNTRY_NAMES[name]
+        anchors = [anchor for anchor in METRO_ANCHORS if anchor[4] in countries]
+        return SearchRegion(location, COUNTRY_REGIONS[name], anchors, [(country, country) for country in countries], countries)
+    for country, subdivisions in (('Canada', PROVINCE_REGIONS), ('United States', STATE_REGIONS)):
+        if name in subdivisions:
+            anchors = [anchor for anchor in METRO_ANCHORS if anchor[5] == name]
+            locations = [(f'{name.title()}, {country}', country)]
+            return SearchRegion(location, [subdivisions[name]], anchors, locations, (country,), name)
+    raise ValueError(f'Unknown region: {location}')
+
+def in_box(anchor, box):
+    south, west, north, east = box
+    return south <= anchor[1] < north and west <= anchor[2] < east
+
+def nearest_anchor(lat, lng, anchors=METRO_ANCHORS):
+    """(distance in meters, anchor) of the closest metro anchor"""
+    return min(((distance_m(lat, lng, anchor[1], anchor[2]), anchor) for anchor in anchors), key=lambda item: item[0])
+
+def distance_m(lat1, lng1, lat2, lng2):
+    """Great-circle distance in meters"""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * 6371000 * math.asin(math.sqrt(min(1.0, a)))
+
+class Tile:
+    """A box of a region, queried as one Nearby Search circle around its center"""
+    
+    def __init__(self, box, anchors):
+        self.box = box
+        self.anchors = anchors  # The region's metro anchors inside the box
+        south, west, north, east = box
+        self.lat = (south + north) / 2
+        self.lng = (west + east) / 2
+        # Circumradius: the circle through the corners covers the whole box
+        self.radius = distance_m(self.lat, self.lng, north, east)
+        self.weight = sum(anchor[3] for anchor in anchors)
+    
+    def target_radius(self):
+        """Radius this tile should be cut down to: smaller around big metros, 50 km elsewhere"""
+        if not self.anchors:
+            return NEARBY_MAX_RADIUS_M
+        densest = max(anchor[3] for anchor in self.anchors)
+        return max(NEARBY_MIN_RADIUS_M, NEARBY_MAX_RADIUS_M / math.sqrt(1 + densest))
+    
+    def split(self):
+        """The four quadrants of this tile"""
+        south, west, north, east = self.box
+        quadrants = [
+            (south, west, self.lat, self.lng), (south, self.lng, self.lat, east),
+            (self.lat, west, north, self.lng), (self.lat, self.lng, north, east),
+        ]
+        return [Tile(quadrant, [a for a in self.anchors if in_box(a, quadrant)]) for quadrant in quadrants]
+
+class TileQueue:
+    """Tiles waiting to be queried.
+    
+    Dense tiles (quadrants of saturated tiles, then tiles around metro areas,
+    most populous first) get most of the queries; NEARBY_SPARSE_SHARE of them go
+    to the sparse space between metros, closest to one of the region's metros
+    first and space nearer a foreign metro last. Sparse tiles
+    are queued whole and only split into Nearby Search sized tiles when they
+    come up, so a country costs no more to plan than a city.
+    """
+    
+    def __init__(self, region):
+        self.region = region
+        self.dense = []
+        self.sparse = []
+        self.order = itertools.count()
+        self.handed_out = 0
+        self.sparse_handed_out = 0
+    
+    def __len__(self):
+        return len(self.dense) + len(self.sparse)
+    
+    def push(self, tile, saturated_parent=False):
+        if saturated_parent:
+            heapq.heappush(self.dense, ((0, 0.0), next(self.order), tile))
+        elif tile.anchors:
+            heapq.heappush(self.dense, ((1, -tile.weight), next(self.order), tile))
+        else:
+            # Space that is closer to a metro outside the region (the far side of a
+            # border the box overlaps) goes last, then by the distance from the
+            # tile's edge (roughly) to the region's nearest metro
+            foreign = nearest_anchor(tile.lat, tile.lng)[1] not in self.region.anchors
+            nearest = nearest_anchor(tile.lat, tile.lng, self.region.anchors)[0] if self.region.anchors else 0.0
+            heapq.heappush(self.sparse, ((foreign, max(0.0, nearest - tile.radius)), next(self.order), tile))
+    
+    def pop(self):
+        """Next tile to query, or None when every tile has been handed out"""
+        while self.dense or self.sparse:
+            sparse_turn = self.sparse and (
+                not self.dense or self.sparse_handed_out < NEARBY_SPARSE_SHARE * (self.handed_out + 1) - 0.5
+            )
+            _, _, tile = heapq.heappop(self.sparse if sparse_turn else self.dense)
+            if tile.radius > NEARBY_MAX_RADIUS_M:
+                for child in tile.split():
+                    self.push(child)
+                continue
+            self.handed_out += 1
+            self.sparse_handed_out += bool(sparse_turn)
+            return tile
+        return None
+
+def plan_tiles(region):
+    """Cut a SearchRegion into tiles and return them as a TileQueue.
+    
+    Tiles with one of the region's metro anchors are split until they are no
+    bigger than their target radius; space without one is kept as coarse
+    sparse tiles.
+    """
+    queue = TileQueue(region)
+    for box in region.boxes:
+        stack = [Tile(box, [anchor for anchor in region.anchors if in_box(anchor, box)])]
+        while stack:
+            tile = stack.pop()
+            if tile.anchors and tile.radius > tile.target_radius():
+                stack.extend(tile.split())
+            else:
+                queue.push(tile)
+    return queue
+
+class PlaceIndex:
+    """Places seen so far, keyed by place_id and by a ~100 m lat/lng grid cell.
+    
+    A place is a duplicate if its place_id was seen, or if a place with the same
+    normalized name sits in the same or a neighbouring cell (tiles overlap, and
+    the same business is sometimes listed twice).
+    """
+    
+    CELL_DEGREES = 0.001
+    
+    def __init__(self):
+        self.place_ids = set()
+        self.cells = {}  # (lat cell, lng cell) -> set of normalized names
+    
+    def add(self, place):
+        """Record a place; False if it was already in the index"""
+        place_id = place.get('place_id')
+        if place_id in self.place_ids:
+            return False
+        
+        location = (place.get('geometry') or {}).get('location') or {}
+        name = normalize_company_name(place.get('name', ''))
+        cell = None
+        if 'lat' in location and 'lng' in location and name:
+            cell = (round(location['lat'] / self.CELL_DEGREES), round(location['lng'] / self.CELL_DEGREES))
+            for d_lat in (-1, 0, 1):
+                for d_lng in (-1, 0, 1):
+                    if name in self.cells.get((cell[0] + d_lat, cell[1] + d_lng), ()):
+                        return False
+        
+        if place_id:
+            self.place_ids.add(place_id)
+        if cell:
+            self.cells.setdefault(cell, set()).add(name)
+        return True
+
+def nearby_search_tile(tile, keyword):
+    """Run one Nearby Search for a tile and return its results"""
+    url = "https://maps.googleapis.com/maps/api/place/nearbysearch/json"
+    params = {
+        'location': f'{tile.lat:.6f},{tile.lng:.6f}',
+        'radius': int(min(tile.radius, NEARBY_MAX_RADIUS_M)),
+        'keyword': keyword,
+        'key': GOOGLE_PLACES_API_KEY
+    }
+    data = google_places_get(url, params, timeout=10)
+    if data.get('status') not in ('OK', 'ZERO_RESULTS'):
+        print(f"Nearby search at {params['location']}: {data.get('status')} {data.get('error_message', '')}")
+    return data.get('results', [])
+
 def search_google_places_nearby(industry, location, max_results=50):
-    """Search using Nearby Search API for better results"""
+    """Search a region with Nearby Search, tile by tile.
+    
+    The region is cut into tiles, small around metro areas and coarse elsewhere
+    (see plan_tiles), which are queried NEARBY_TILE_WORKERS at a time, up to
+    NEARBY_MAX_TILES. A tile returning a full page is split into quadrants and
+    those are queried next. Results are deduplicated through a
+    PlaceIndex, ranked, and only the best max_results get detail lookups;
+    places whose address turns out to be outside the region are dropped.
+    """
     companies = []
     
     if not GOOGLE_PLACES_API_KEY:
         return companies
     
     try:
-        # Major cities in Canada and USA
-        cities = [
-            {'lat': 43.6532, 'lng': -79.3832, 'name': 'Toronto, Canada'},
-            {'lat': 45.5017, 'lng': -73.5673, 'name': 'Montreal, Canada'},
-            {'lat': 49.2827, 'lng': -123.1207, 'name': 'Vancouver, Canada'},
-            {'lat': 40.7128, 'lng': -74.0060, 'name': 'New York, USA'},
-            {'lat': 34.0522, 'lng': -118.2437, 'name': 'Los Angeles, USA'},
-            {'lat': 41.8781, 'lng': -87.6298, 'name': 'Chicago, USA'},
-            {'lat': 29.7604, 'lng': -95.3698, 'name': 'Houston, USA'},
-            {'lat': 37.7749, 'lng': -122.4194, 'name': 'San Francisco, USA'},
-        ]
-        
-        results_per_city = max_results // len(cities)
-        
-        for city in cities:
-            # Focus on transportation-relevant industries
-            # Modify query to prioritize B2B companies
-            query_terms = []
-            if industry.lower() not in TRANSPORTATION_KEYWORDS:
-                # Add transportation-related terms to the query
-                query_terms.append(f"{industry} manufacturing")
-                query_terms.append(f"{industry} distribution")
-                query_terms.append(f"{industry} warehouse")
-            else:
-                query_terms.append(f"{industry}")
-            
-            # Use the first query term
-            query = f"{query_terms[0]} in {city['name']}"
-            
-            # First, find places using text search
-            url = "https://maps.googleapis.com/maps/api/place/textsearch/json"
-            params = {
-                'query': query,
-                'key': GOOGLE_PLACES_API_KEY,
-                'type': 'establishment'
-            }
-            
-            response = requests.get(url, params=params)
-            data = response.json()
-            
-            if data.get('status') == 'OK':
-                for place in data.get('results', [])[:results_per_city]:
-                    # Filter out retail stores and small shops
-                    if not is_transportation_relevant_company(
-                        place,
-                        place.get('name', ''),
-                        place.get('formatted_address', '')
-                    ):
-                        continue
-                    
-                    # Get detailed information
-                    details_url = "https://maps.googleapis.com/maps/api/place/details/json"
-                    details_params = {
-                        'place_id': place.get('place_id'),
-                        'key': GOOGLE_PLACES_API_KEY,
-                        'fields': 'name,formatted_address,formatted_phone_number,website,rating,business_status,types'
-                    }
-                    
-                    details_response = requests.get(details_url, params=details_params)
-                    details_data = details_response.json()
-                    
-                    if details_data.get('status') == 'OK':
-                        place_details = details_data.get('result', {})
-                        
-                        # Determine country
-                        address = place_details.get('formatted_address', '')
-                        country = 'Canada' if 'Canada' in address or city['name'].endswith('Canada') else 'United States'
-                        
-                        # Get email if available
-                        email = place_details.get('email', '')
-                        if not email and place_details.get('website'):
-                            email = extract_email_from_website(place_details.get('website'))
-                        
-                        company = {
-                            'name': place_details.get('name', ''),
-                            'address': address,
-                            'phone': place_details.get('formatted_phone_number', place_details.get('international_phone_number', '')),
-                            'email': email,
-                            'website': place_details.get('website', ''),
-                            'rating': place_details.get('rating', ''),
-                            'country': country,
-                            'industry': industry,
-                            'place_id': place.get('place_id', ''),
-                            'business_type': ', '.join([t for t in place_details.get('types', []) if t not in ['point_of_interest', 'establishment']][:3])
-                        }
-                        companies.append(company)
-            
-            time.sleep(0.3)  # Rate limiting
+        region = parse_region(location)
+    except ValueError as e:
+        print(f"Nearby search: {e}")
+        return companies
+    
+    # Focus on transportation-relevant industries
+    if industry.lower() not in TRANSPORTATION_KEYWORDS:
+        keyword = f"{industry} manufacturing"
+    else:
+        keyword = industry
+    
+    queue = plan_tiles(region)
+    update_progress('searching', f'Searching {location} area by area...', 0, f'Nearby search for "{keyword}" in {location}')
+    
+    index = PlaceIndex()
+    candidates = []  # Relevant places, in the order found
+    queried = 0
+    executor = ThreadPoolExecutor(max_workers=NEARBY_TILE_WORKERS, thread_name_prefix='nearby')
+    try:
+        in_flight = {}
+        while time_remaining() > 0:
+            enough = len(candidates) >= max_results * NEARBY_CANDIDATE_FACTOR
+            while not enough and queried < NEARBY_MAX_TILES and len(in_flight) < NEARBY_TILE_WORKERS:
+                tile = queue.pop()
+                if tile is None:
+                    break
+                in_flight[submit_in_context(executor, nearby_search_tile, tile, keyword)] = tile
+                queried += 1
+            if not in_flight:
+                break
             
-    except Exception as e:
-        print(f"Error in Google Places nearby search: {e}")
+            done, _ = wait(in_flight, timeout=wait_budget(), return_when=FIRST_COMPLETED)
+            for future in done:
+                tile = in_flight.pop(future)
+                try:
+                    places = future.result()
+                except Exception as e:
+                    print(f"Error in nearby search tile: {e}")
+                    continue
+                
+                # A full page means the tile is dense - query its quadrants as well
+                if len(places) >= NEARBY_PAGE_SIZE and tile.radius / 2 >= NEARBY_MIN_RADIUS_M:
+                    for child in tile.split():
+                        queue.push(child, saturated_parent=True)
+                
+                new_places = [place for place in places if index.add(place)]
+                # Filter out retail stores and small shops
+                candidates.extend(place for place, relevant in zip(new_places, classify_places(new_places)) if relevant)
+            update_progress('processing', f'Searched {queried} areas, {len(candidates)} candidates', len(companies))
+    finally:
+        # Tiles still queued or running at the deadline are dropped
+        executor.shutdown(wait=False, cancel_futures=True)
+    
+    print(f"Nearby search: {queried} tiles queried, {len(candidates)} distinct candidates")
+    
+    # Look up details for the best scoring places only
+    best = rank_candidates(candidates, limit=max_results)
+    place_details = fetch_place_details_concurrently([place.get('place_id', '') for place in best], timeout=5)
+    for place in best:
+        details = place_details.get(place.get('place_id', ''), {})
+        if not region.contains(details.get('country'), details.get('state')):
+            continue
+        # Without an address, assume the country of the closest metro
+        location = place.get('geometry', {}).get('location', {})
+        country = nearest_anchor(location.get('lat', 0.0), location.get('lng', 0.0))[1][4] if location else ''
+        company = place_to_company(place, details, country, industry)
+        companies.append(company)
+        publish_company(company)
     
     return companies
 
@@ -615,26 +2188,109 @@ def search_zoominfo_api(industry, location, max_results=50):
     
     return companies
 
+def apollo_org_to_company(org, industry_field):
+    """Build a company record from an Apollo organization, or None if it isn't relevant"""
+    # Filter out retail stores
+    org_name = org.get('name', '').lower()
+    if any(excluded in org_name for excluded in ['restaurant', 'cafe', 'retail', 'shop', 'store']):
+        # Skip unless it's wholesale or distribution
+        if 'wholesale' not in org_name and 'distribution' not in org_name:
+            return None
+    
+    # Get location info
+    locations = org.get('organization_raw_addresses', [])
+    address = ''
+    country = 'United States'
+    
+    if locations:
+        primary_location = locations[0]
+        address_parts = []
+        if primary_location.get('street_address'):
+            address_parts.append(primary_location['street_address'])
+        if primary_location.get('city'):
+            address_parts.append(primary_location['city'])
+        if primary_location.get('state'):
+            address_parts.append(primary_location['state'])
+        if primary_location.get('postal_code'):
+            address_parts.append(primary_location['postal_code'])
+        address = ', '.join(address_parts)
+        
+        country = primary_location.get('country', 'United States')
+    
+    # Get contact info
+    phone = org.get('phone_numbers', [{}])[0].get('raw_number', '') if org.get('phone_numbers') else ''
+    website = org.get('website_url', '')
+    email = org.get('email', '')
+    
+    # Get industry/type
+    industry_tags = org.get('industry', '')
+    if isinstance(industry_tags, list):
+        industry_tags = ', '.join(industry_tags[:3])
+    
+    company = {
+        'name': org.get('name', ''),
+        'address': address,
+        'phone': phone,
+        'email': email,
+        'website': website,
+        'rating': '',
+        'country': country,
+        'industry': industry_field,
+        'place_id': org.get('id', ''),
+        'business_type': industry_tags or 'B2B Company',
+        'employee_count': org.get('estimated_num_employees', ''),
+        'revenue': org.get('estimated_annual_revenue', '')
+    }
+    
+    # Only add if it's transportation-relevant
+    if not is_transportation_relevant_company(
+        {'types': org.get('industry', [])},
+        company['name'],
+        company['address']
+    ):
+        return None
+    return company
+
+def fetch_apollo_page(payload, page):
+    """Fetch one page of an Apollo organization search. Returns (status_code, data)."""
+    url = "https://api.apollo.io/v1/organizations/search"
+    # Apollo uses HTTP Basic Auth - API key as username, 'X' as password
+    auth = (APOLLO_API_KEY, 'X')
+    headers = {
+        'Content-Type': 'application/json',
+        'Cache-Control': 'no-cache'
+    }
+    
+    response = get_http_session('apollo').post(url, json=dict(payload, page=page), headers=headers, auth=auth, timeout=15)
+    if response.status_code == 200:
+        return 200, response.json()
+    
+    if response.status_code == 401:
+        print("Apollo API: Authentication failed. Check your API key.")
+    elif response.status_code == 429:
+        print("Apollo API: Rate limit exceeded. Please wait.")
+    else:
+        print(f"Apollo API Error: Status {response.status_code} - {response.text[:200]}")
+    return response.status_code, {}
+
 def search_apollo_api(industry, location, max_results=50, search_type='industry', product=''):
-    """Search for companies using Apollo.io API"""
+    """Search for companies using Apollo.io API.
+    
+    Page 1 gives the number of pages; the following pages are then requested
+    APOLLO_PAGE_CONCURRENCY at a time, and organizations are published as each
+    page arrives until max_results unique relevant companies are found.
+    """
     companies = []
     
     if not APOLLO_API_KEY:
         return companies
     
+    executor = None
     try:
-        # Apollo.io API endpoint for searching organizations
-        url = "https://api.apollo.io/v1/organizations/search"
-        
-        # Apollo uses HTTP Basic Auth - API key as username, 'X' as password
-        auth = (APOLLO_API_KEY, 'X')
-        
-        # Determine location codes
-        location_codes = []
-        if 'canada' in location.lower() or 'north america' in location.lower():
-            location_codes.append('Canada')
-        if 'usa' in location.lower() or 'united states' in location.lower() or 'north america' in location.lower():
-            location_codes.append('United States')
+        # Apollo takes the same place names as the text searches
+        location_codes = [loc for loc, country in parse_region(location).locations]
+        if not location_codes:
+            return companies
         
         # Build search query based on search type
         if search_type == 'product' and product:
@@ -647,114 +2303,146 @@ def search_apollo_api(industry, location, max_results=50, search_type='industry'
                 # Add transportation modifiers
                 search_query = f"{industry} manufacturing OR {industry} distribution OR {industry} warehouse OR {industry} logistics"
         
-        # Prepare request payload
+        # Prepare request payload (the page number is added per request)
         payload = {
             'api_key': APOLLO_API_KEY,
             'q_keywords': search_query,
-            'page': 1,
-            'per_page': min(max_results, 25),  # Apollo limits per page
+            'per_page': min(max_results, APOLLO_PER_PAGE),  # Apollo limits per page
             'organization_locations': location_codes,
             # Filter for companies that need transportation
-            'organization_keywords': ['manufacturing', 'warehouse', 'distribution', 'logistics', 'freight', 'wholesale', 'industrial'],
-            'organization_num_employees_ranges': ['1,10', '11,50', '51,200', '201,500', '501,1000', '1001,5000', '5001,10000', '10001,'],
-            # Exclude retail and small shops
-            'exclude_organization_keywords': ['restaurant', 'cafe', 'retail store', 'shop', 'salon', 'spa', 'gym'],
-        }
-        
-        headers = {
-            'Content-Type': 'application/json',
-            'Cache-Control': 'no-cache'
-        }
-        
-        response = requests.post(url, json=payload, headers=headers, auth=auth, timeout=15)
-        
-        if response.status_code == 200:
-            data = response.json()
-            organizations = data.get('organizations', [])
-            
-            for org in organizations:
-                # Filter out retail stores
-                org_name = org.get('name', '').lower()
-                if any(excluded in org_name for excluded in ['restaurant', 'cafe', 'retail', 'shop', 'store']):
-                    # Skip unless it's wholesale or distribution
-                    if 'wholesale' not in org_name and 'distribution' not in org_name:
-                        continue
-                
-                # Get location info
-                locations = org.get('organization_raw_addresses', [])
-                address = ''
-                country = 'United States'
-                
-                if locations:
-                    primary_location = locations[0]
-                    address_parts = []
-                    if primary_location.get('street_address'):
-                        address_parts.append(primary_location['street_address'])
-                    if primary_location.get('city'):
-                        address_parts.append(primary_location['city'])
-                    if primary_location.get('state'):
-                        address_parts.append(primary_location['state'])
-                    if primary_location.get('postal_code'):
-                        address_parts.append(primary_location['postal_code'])
-                    address = ', '.join(address_parts)
-                    
-                    country = primary_location.get('country', 'United States')
-                
-                # Get contact info
-                phone = org.get('phone_numbers', [{}])[0].get('raw_number', '') if org.get('phone_numbers') else ''
-                website = org.get('website_url', '')
-                email = org.get('email', '')
-                
-                # Get industry/type
-                industry_tags = org.get('industry', '')
-                if isinstance(industry_tags, list):
-                    industry_tags = ', '.join(industry_tags[:3])
-                
-                # Determine industry field
-                industry_field = industry if search_type == 'industry' else (product + ' manufacturer')
-                
-                company = {
-                    'name': org.get('name', ''),
-                    'address': address,
-                    'phone': phone,
-                    'email': email,
-                    'website': website,
-                    'rating': '',
-                    'country': country,
-                    'industry': industry_field,
-                    'place_id': org.get('id', ''),
-                    'business_type': industry_tags or 'B2B Company',
-                    'employee_count': org.get('estimated_num_employees', ''),
-                    'revenue': org.get('estimated_annual_revenue', '')
-                }
-                
-                # Only add if it's transportation-relevant
-                if is_transportation_relevant_company(
-                    {'types': org.get('industry', [])},
-                    company['name'],
-                    company['address']
-                ):
-                    companies.append(company)
-        
-        elif response.status_code == 401:
-            print("Apollo API: Authentication failed. Check your API key.")
-        elif response.status_code == 429:
-            print("Apollo API: Rate limit exceeded. Please wait.")
-        else:
-            print(f"Apollo API Error: Status {response.status_code} - {response.text[:200]}")
-        
-        time.sleep(0.5)  # Rate limiting for Apollo
+            'organization_keywords': ['manufacturing', 'warehouse', 'distribution', 'logistics', 'freight', 'wholesale', 'industrial'],
+            'organization_num_employees_ranges': ['1,10', '11,50', '51,200', '201,500', '501,1000', '1001,5000', '5001,10000', '10001,'],
+            # Exclude retail and small shops
+            'exclude_organization_keywords': ['restaurant', 'cafe', 'retail store', 'shop', 'salon', 'spa', 'gym'],
+        }
         
+        # Determine industry field
+        industry_field = industry if search_type == 'industry' else (product + ' manufacturer')
+        seen_ids = set()
+        
+        def add_organizations(data):
+            for org in data.get('organizations', []):
+                if len(companies) >= max_results:
+                    return
+                org_id = org.get('id') or org.get('name', '')
+                if org_id in seen_ids:
+                    continue
+                seen_ids.add(org_id)
+                company = apollo_org_to_company(org, industry_field)
+                if company:
+                    companies.append(company)
+                    publish_company(company)
+        
+        status, data = fetch_apollo_page(payload, 1)
+        if status != 200:
+            return companies
+        add_organizations(data)
+        pages_read = 1
+        
+        total_pages = min((data.get('pagination') or {}).get('total_pages') or 1, APOLLO_MAX_PAGES)
+        next_page = 2
+        executor = ThreadPoolExecutor(max_workers=APOLLO_PAGE_CONCURRENCY, thread_name_prefix='apollo')
+        in_flight = {}
+        while len(companies) < max_results and time_remaining() > 0:
+            # Keep a few pages in flight; the rate limiter spaces the requests out
+            while next_page <= total_pages and len(in_flight) < APOLLO_PAGE_CONCURRENCY:
+                in_flight[submit_in_context(executor, fetch_apollo_page, payload, next_page)] = next_page
+                next_page += 1
+            if not in_flight:
+                break
+            
+            done, _ = wait(in_flight, timeout=wait_budget(), return_when=FIRST_COMPLETED)
+            for future in done:
+                page = in_flight.pop(future)
+                try:
+                    status, data = future.result()
+                except Exception as e:
+                    print(f"Error fetching Apollo page {page}: {e}")
+                    continue
+                if status == 401:
+                    # Every other page would fail the same way
+                    total_pages = 0
+                    continue
+                add_organizations(data)
+                pages_read += 1
+        
+        if len(companies) >= max_results:
+            print(f"Apollo: found enough companies ({len(companies)}) after {pages_read} of {total_pages} pages")
+        
+    except DeadlineExceeded:
+        print(f"Apollo: search deadline reached with {len(companies)} companies")
     except Exception as e:
         print(f"Error in Apollo API search: {e}")
         import traceback
         traceback.print_exc()
+    finally:
+        if executor:
+            # Pages still queued are not needed any more
+            executor.shutdown(wait=False, cancel_futures=True)
     
     return companies
 
-def search_product_manufacturers(product, industry_filter=''):
-    """Search for companies that manufacture a specific product"""
+def plan_product_search(search_terms, max_results, search_context, location=DEFAULT_SEARCH_REGION):
+    """Search every query variant in every location of the region, then enrich each distinct place once.
+    
+    All text searches run first (in parallel) and their results are merged by
+    place_id. Places returned by several variants rank higher; only the best
+    max_results of the union get detail lookups.
+    """
+    region = parse_region(location)
+    queries = [(term, loc, country) for term in search_terms for loc, country in region.locations]
+    if not queries:
+        return []
+    
+    update_progress('searching', f'Running {len(queries)} searches...', 0, f'Variants: {", ".join(search_terms)}')
+    executor = ThreadPoolExecutor(max_workers=min(len(queries), DETAILS_MAX_WORKERS), thread_name_prefix='text-search')
+    try:
+        futures = [submit_in_context(executor, text_search_places, f"{term} in {loc}", loc) for term, loc, country in queries]
+        wait(futures, timeout=wait_budget())
+    finally:
+        # Searches still running at the deadline are left behind
+        executor.shutdown(wait=False, cancel_futures=True)
+    
+    # Union of all results by place_id, in query order; remember where each was first found
+    planned = OrderedDict()
+    total_results = 0
+    for (term, loc, country), future in zip(queries, futures):
+        if not future.done() or future.cancelled():
+            continue
+        try:
+            places = future.result()
+        except Exception as e:
+            print(f"Error searching {term} in {loc}: {e}")
+            continue
+        total_results += len(places)
+        for place in places:
+            place_id = place.get('place_id')
+            if place_id:
+                planned.setdefault(place_id, {'place': place, 'country': country, 'terms': set()})['terms'].add(term)
+    
+    places = [dict(entry['place'], query_matches=len(entry['terms'])) for entry in planned.values()]
+    candidates = [place for place, relevant in zip(places, classify_places(places)) if relevant]
+    candidates = rank_candidates(candidates, limit=max_results)
+    print(f"Product search plan: {total_results} results, {len(planned)} distinct places, enriching {len(candidates)}")
+    
+    update_progress('processing', f'Fetching details for {len(candidates)} distinct companies...', 0)
+    place_details = fetch_place_details_concurrently([place['place_id'] for place in candidates], timeout=2)
+    
     companies = []
+    for place in candidates:
+        details = place_details.get(place['place_id'], {})
+        if not region.contains(details.get('country'), details.get('state')):
+            continue
+        company = place_to_company(place, details, planned[place['place_id']]['country'], search_context)
+        companies.append(company)
+        publish_company(company)
+        update_progress('found', f'Found: {company["name"][:40]}...', len(companies))
+    return companies
+
+def search_product_manufacturers(product, industry_filter='', location=DEFAULT_SEARCH_REGION):
+    """Search for companies that manufacture a specific product"""
+    if not GOOGLE_PLACES_API_KEY:
+        return []
     
     # Build search queries for product manufacturers
     if industry_filter:
@@ -762,7 +2450,7 @@ def search_product_manufacturers(product, industry_filter=''):
             f"{product} manufacturer {industry_filter}",
             f"{product} manufacturing {industry_filter}",
             f"{product} factory {industry_filter}",
-            f"{product} production {industry_filter}"
+            f"{product} {industry_filter} manufacturer"
         ]
     else:
         # Auto-detect - try common manufacturing terms
@@ -770,119 +2458,265 @@ def search_product_manufacturers(product, industry_filter=''):
             f"{product} manufacturer",
             f"{product} manufacturing",
             f"{product} factory",
-            f"{product} production",
-            f"{product} maker",
-            f"{product} producer"
         ]
     
     update_progress('searching', f'Searching for manufacturers of: {product}', 0, f'Looking for companies that make {product}...')
     
-    # Search each term
-    for term in search_terms[:3]:  # Limit to first 3 terms
-        update_progress('searching', f'Searching: {term}...', len(companies), f'Query: {term}')
-        # Pass product as search_context so industry field is set correctly
-        google_companies = search_google_places(term, 'North America', 30, search_context=f"{product} manufacturer")
-        companies.extend(google_companies)
-        update_progress('found', f'Found {len(google_companies)} companies for "{term}"', len(companies))
-    
+    # One plan for all variants and locations, so each company is looked up once
+    try:
+        companies = plan_product_search(search_terms, MAX_COMPANIES, f"{product} manufacturer", location)
+    except DeadlineExceeded:
+        companies = []
+        update_progress('warning', 'timeout', 0, 'Stopping search: time budget used up')
+    update_progress('found', f'Found {len(companies)} manufacturers of {product}', len(companies))
     return companies
 
-def get_companies_from_directories(industry, search_type='industry', product='', industry_filter=''):
-    """Get companies from multiple sources, filtered for transportation needs"""
+# Legal suffixes that don't make companies different
+COMPANY_SUFFIX_PATTERN = re.compile(r'\b(inc\.?|incorporated|llc|llc\.?|ltd\.?|limited|corp\.?|corporation|co\.?|company)\b')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+NAME_TOKEN_PATTERN = re.compile(r'[^\W_]+')  # Letters and digits of any script
+NAME_STOPWORDS = frozenset({'the', 'and', 'of'})
+NON_DIGIT_PATTERN = re.compile(r'\D')
+PHONE_EXTENSION_PATTERN = re.compile(r'\s*(?:ext\.?|x|#)\s*\d+\s*$', re.IGNORECASE)
+
+# Directory, social and site-builder domains shared by unrelated businesses - never used as a dedup key
+GENERIC_WEBSITE_DOMAINS = frozenset({
+    'yelp.com', 'yelp.ca', 'facebook.com', 'fb.com', 'instagram.com', 'linkedin.com', 'twitter.com', 'x.com',
+    'youtube.com', 'tiktok.com', 'google.com', 'goo.gl', 'yellowpages.com', 'yellowpages.ca', 'bbb.org',
+    'mapquest.com', 'wixsite.com', 'wix.com', 'squarespace.com', 'weebly.com', 'wordpress.com', 'blogspot.com',
+    'godaddysites.com', 'business.site', 'linktr.ee',
+})
+
+DEDUP_MAX_BLOCK_SIZE = 100  # Phone blocks larger than this (shared switchboards) are not compared pairwise
+
+def normalize_company_name(name):
+    """Normalize company name for better duplicate detection"""
+    if not name:
+        return ''
+    # Convert to lowercase and remove extra spaces
+    normalized = name.lower().strip()
+    # Remove common suffixes/legal entities (they don't make companies different)
+    normalized = COMPANY_SUFFIX_PATTERN.sub('', normalized)
+    # Remove extra spaces
+    normalized = WHITESPACE_PATTERN.sub(' ', normalized)
+    return normalized.strip()
+
+def name_tokens(name):
+    """Set of words in a normalized company name, without punctuation, accents and stopwords
+    ('Énergie Québec' and 'Energie Quebec' have the same tokens)"""
+    folded = fold_accents(normalize_company_name(name))
+    return frozenset(token for token in NAME_TOKEN_PATTERN.findall(folded) if token not in NAME_STOPWORDS)
+
+def e164_phone(phone):
+    """Normalize a phone number to E.164 (+15551234567), or '' if it can't be.
+    
+    Numbers without a country code are taken as North American.
+    """
+    if not phone:
+        return ''
+    phone = PHONE_EXTENSION_PATTERN.sub('', str(phone)).strip()
+    digits = NON_DIGIT_PATTERN.sub('', phone)
+    if phone.startswith('+'):
+        return f'+{digits}' if 8 <= len(digits) <= 15 else ''
+    if len(digits) == 10:
+        return f'+1{digits}'
+    if len(digits) == 11 and digits[0] == '1':
+        return f'+{digits}'
+    return ''
+
+def website_key(website):
+    """Registrable domain of a company website, or '' for directory/social pages"""
+    domain = registrable_domain(website)
+    return '' if domain in GENERIC_WEBSITE_DOMAINS else domain
+
+def merge_company_records(records):
+    """Merge duplicate records into the first one, filling its empty fields from the others"""
+    merged = dict(records[0])
+    for record in records[1:]:
+        for key, value in record.items():
+            if merged.get(key) in (None, '') and value not in (None, ''):
+                merged[key] = value
+    return merged
+
+def dedupe_companies(companies):
+    """Merge records that describe the same company, keeping the order they were found in.
+    
+    Records are grouped into blocks by name token signature, website domain and
+    E.164 phone, and only compared within a block. Records sharing a name
+    signature or a domain are the same company (one entry per company, not per
+    office); records sharing a phone also need overlapping names. Matches are
+    joined with union-find, so the whole pass is near-linear. Records without a
+    name are dropped; names without any word (only punctuation) are only merged
+    with the exact same name. Returns (unique_companies, duplicate_count).
+    """
+    records = []
+    tokens = []
+    name_keys = []
+    for company in companies:
+        normalized = normalize_company_name(company.get('name', ''))
+        if normalized:
+            company_tokens = name_tokens(normalized)
+            records.append(company)
+            tokens.append(company_tokens)
+            name_keys.append(' '.join(sorted(company_tokens)) if company_tokens else f'={normalized}')
+    
+    parent = list(range(len(records)))
+    
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    
+    def union(i, j):
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            # The earliest record stays the root, so merges keep provider order
+            if root_j < root_i:
+                root_i, root_j = root_j, root_i
+            parent[root_j] = root_i
+    
+    name_blocks = {}
+    domain_blocks = {}
+    phone_blocks = {}
+    for i, company in enumerate(records):
+        name_blocks.setdefault(name_keys[i], []).append(i)
+        if not tokens[i]:
+            continue
+        domain = website_key(company.get('website'))
+        if domain:
+            domain_blocks.setdefault(domain, []).append(i)
+        phone = e164_phone(company.get('phone'))
+        if phone:
+            phone_blocks.setdefault(phone, []).append(i)
+    
+    for block in itertools.chain(name_blocks.values(), domain_blocks.values()):
+        for i in block[1:]:
+            union(block[0], i)
+    
+    for block in phone_blocks.values():
+        if len(block) > DEDUP_MAX_BLOCK_SIZE:
+            continue
+        for a, i in enumerate(block):
+            for j in block[a + 1:]:
+                shared = len(tokens[i] & tokens[j])
+                if shared and shared * 2 >= min(len(tokens[i]), len(tokens[j])):
+                    union(i, j)
+    
+    clusters = {}
+    for i in range(len(records)):
+        clusters.setdefault(find(i), []).append(records[i])
+    
+    unique_companies = [merge_company_records(cluster) for cluster in clusters.values()]
+    return unique_companies, len(records) - len(unique_companies)
+
+def search_all_providers(industry, search_type='industry', product='', industry_filter='', target_count=None, time_budget=None, region=DEFAULT_SEARCH_REGION):
+    """Run every configured provider at the same time under one shared deadline
+    (the search's own deadline, or time_budget from now if that comes first).
+    
+    Results are merged as each provider finishes. Returns once all providers are done,
+    the deadline passes or target_count distinct companies have been collected;
+    providers still running then are cancelled.
+    """
+    if target_count is None:
+        target_count = MAX_COMPANIES
+    if time_budget is None:
+        time_budget = SEARCH_TIME_BUDGET
+    with deadline_scope(time_budget), cancel_scope() as cancel:
+        try:
+            return run_providers(industry, search_type, product, industry_filter, target_count, region)
+        finally:
+            # Providers still running are no longer waited for - stop them
+            cancel.set()
+
+def run_providers(industry, search_type, product, industry_filter, target_count, region=DEFAULT_SEARCH_REGION):
+    """Run the providers for a search until they finish, the current deadline passes or target_count is reached.
+    
+    Every provider searches region (a country, province/state or bbox).
+    """
+
+    if search_type == 'product' and product:
+        term = f"{product} manufacturer"
+        
+        providers = [
+            ('Google Places', GOOGLE_PLACES_API_KEY, lambda: search_product_manufacturers(product, industry_filter, region)),
+            ('Apollo.io', APOLLO_API_KEY, lambda: search_apollo_api(product, region, target_count, 'product', product)),
+            ('Yelp', YELP_API_KEY, lambda: search_yelp(term, region, target_count)),
+            ('Google Places Nearby', GOOGLE_PLACES_API_KEY, lambda: search_google_places_nearby(term, region, target_count)),
+        ]
+    else:
+        providers = [
+            ('Google Places', GOOGLE_PLACES_API_KEY, lambda: search_google_places(industry, region, target_count)),
+            ('Apollo.io', APOLLO_API_KEY, lambda: search_apollo_api(industry, region, target_count)),
+            ('Yelp', YELP_API_KEY, lambda: search_yelp(industry, region, target_count)),
+            ('Google Places Nearby', GOOGLE_PLACES_API_KEY, lambda: search_google_places_nearby(industry, region, target_count)),
+        ]
+    
+    # Only run providers that have an API key configured
+    providers = [(name, provider) for name, api_key, provider in providers if api_key]
     companies = []
+    if not providers:
+        return companies
+    
+    seen_names = set()
+    executor = ThreadPoolExecutor(max_workers=len(providers), thread_name_prefix='provider')
+    try:
+        futures = {submit_in_context(executor, provider): name for name, provider in providers}
+        pending = set(futures)
+        print(f"Searching {', '.join(futures.values())} in parallel ({time_remaining():.0f}s left)...")
+        
+        while pending:
+            remaining = time_remaining()
+            if remaining <= 0:
+                break
+            
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = futures[future]
+                try:
+                    provider_companies = future.result()
+                except Exception as e:
+                    print(f"Error in {name} search: {e}")
+                    continue
+                
+                companies.extend(provider_companies)
+                seen_names.update(name for name in (normalize_company_name(company.get('name', '')) for company in provider_companies) if name)
+                print(f"Found {len(provider_companies)} companies from {name}")
+                update_progress('found', f'{name} search finished', len(companies), f'Found {len(provider_companies)} companies from {name}')
+            
+            if len(seen_names) >= target_count:
+                print(f"Found {len(seen_names)} companies, not waiting for remaining providers")
+                break
+        
+        if pending:
+            skipped = ', '.join(futures[future] for future in pending)
+            print(f"Not waiting for: {skipped}")
+            update_progress('warning', 'timeout', len(companies), f'Stopped waiting for {skipped}')
+    finally:
+        # Return without waiting for providers that are still running
+        executor.shutdown(wait=False, cancel_futures=True)
     
+    return companies
+
+def get_companies_from_directories(industry, search_type='industry', product='', industry_filter='', region=DEFAULT_SEARCH_REGION):
+    """Get companies from multiple sources, filtered for transportation needs"""
     if search_type == 'product' and product:
-        # Product-based search
         update_progress('searching', f'Searching for manufacturers of: {product}', 0, 'Starting product manufacturer search...')
-        product_companies = search_product_manufacturers(product, industry_filter)
-        companies.extend(product_companies)
-        print(f"Found {len(product_companies)} product manufacturers")
-        
-        # Also try with industry filter if provided
-        if industry_filter:
-            additional_companies = search_google_places(f"{product} {industry_filter} manufacturer", 'North America', 30)
-            companies.extend(additional_companies)
     else:
-        # Industry-based search (original functionality)
-        # Modify industry query to focus on B2B/transportation-relevant companies
-        search_queries = [industry]
-        
-        # Add transportation-related modifiers if not already present
-        if industry.lower() not in TRANSPORTATION_KEYWORDS:
-            search_queries.extend([
-                f"{industry} manufacturing",
-                f"{industry} distribution",
-                f"{industry} warehouse",
-                f"{industry} wholesale"
-            ])
-        
-        # Try Google Places Text Search first (faster)
-        # Reduced max_results to avoid timeout
-        print(f"Searching Google Places for {industry} (filtering for transportation-relevant companies)...")
-        google_companies = search_google_places(industry, 'North America', 30, timeout_seconds=20)  # Reduced to 30, 20s timeout
-        companies.extend(google_companies)
-        print(f"Found {len(google_companies)} transportation-relevant companies from Google Places")
-        
-        # Early return if we have enough
-        if len(companies) >= 20:
-            print(f"Found {len(companies)} companies, returning early to avoid timeout")
-            return companies[:20]
-    
-    # Skip Nearby Search and Yelp - they're too slow and cause timeout
-    # Try Apollo.io API (faster than multiple Google searches)
-    if len(companies) < 20 and APOLLO_API_KEY:
-        if search_type == 'product' and product:
-            print(f"Searching Apollo.io for manufacturers of {product}...")
-            apollo_companies = search_apollo_api(product, 'North America', 20, 'product', product)  # Reduced to 20
-        else:
-            print(f"Searching Apollo.io for {industry}...")
-            apollo_companies = search_apollo_api(industry, 'North America', 20)  # Reduced to 20
-        companies.extend(apollo_companies)
-        print(f"Found {len(apollo_companies)} companies from Apollo.io")
-    
-    # Skip Yelp and Nearby Search - they're too slow and cause timeout
-    # Return what we have to avoid timeout
-    
-    # Remove duplicates based on company name only
-    # If same company appears at multiple offices/locations, keep only the first one
-    def normalize_company_name(name):
-        """Normalize company name for better duplicate detection"""
-        if not name:
-            return ''
-        # Convert to lowercase and remove extra spaces
-        normalized = name.lower().strip()
-        # Remove common suffixes/legal entities (they don't make companies different)
-        normalized = re.sub(r'\b(inc\.?|incorporated|llc|llc\.?|ltd\.?|limited|corp\.?|corporation|co\.?|company)\b', '', normalized)
-        # Remove extra spaces
-        normalized = re.sub(r'\s+', ' ', normalized)
-        return normalized.strip()
-    
-    seen = set()
-    unique_companies = []
-    duplicate_count = 0
+        print(f"Searching for {industry} (filtering for transportation-relevant companies)...")
     
-    for company in companies:
-        name_normalized = normalize_company_name(company.get('name', ''))
-        
-        # Create a key for deduplication: company_name only
-        # Same company at multiple offices = duplicate (removed, keep only first)
-        # Different companies = kept
-        if name_normalized and name_normalized not in seen:
-            seen.add(name_normalized)
-            unique_companies.append(company)
-        else:
-            duplicate_count += 1
-            original_name = company.get('name', 'Unknown')
-            address = company.get('address', 'No address')
-            print(f"Skipped duplicate company: {original_name} at {address[:50]}")
+    # All providers run in parallel under one deadline
+    companies = search_all_providers(industry, search_type, product, industry_filter, region=region)
     
+    # Merge duplicates: same company from several providers or at several offices
+    unique_companies, duplicate_count = dedupe_companies(companies)
     if duplicate_count > 0:
-        print(f"Removed {duplicate_count} duplicate entries (same company at multiple offices)")
-        print(f"Kept {len(unique_companies)} unique companies (one entry per company)")
+        print(f"Merged {duplicate_count} duplicate entries into {len(unique_companies)} unique companies")
     
+    # Best leads first
+    unique_companies = rank_candidates(unique_companies, limit=MAX_COMPANIES)
     print(f"Total unique companies found: {len(unique_companies)}")
-    # Return max 20 companies to avoid timeout (reduced from 100)
-    return unique_companies[:20]
+    return unique_companies
 
 @app.route('/')
 def index():
@@ -890,20 +2724,21 @@ def index():
 
 @app.route('/api/progress', methods=['GET'])
 def get_progress():
-    """Get current search progress"""
-    global current_progress
+    """Get progress of a search job (?job_id=...)"""
+    job_id = request.args.get('job_id', '')
     try:
-        with progress_lock:
-            # Create a safe copy to avoid any threading issues
-            progress_copy = {
-                'status': current_progress.get('status', 'idle'),
-                'current_step': current_progress.get('current_step', ''),
-                'companies_found': current_progress.get('companies_found', 0),
-                'total_steps': current_progress.get('total_steps', 0),
-                'current_step_num': current_progress.get('current_step_num', 0),
-                'details': current_progress.get('details', [])[-10:]  # Only return last 10 for performance
-            }
-            return jsonify(progress_copy)
+        progress = progress_store.get(job_id) if job_id else None
+        if progress is None:
+            return jsonify({
+                'status': 'idle',
+                'current_step': '',
+                'companies_found': 0,
+                'total_steps': 0,
+                'current_step_num': 0,
+                'details': []
+            })
+        progress['details'] = progress['details'][-10:]  # Only return last 10 for performance
+        return jsonify(progress)
     except Exception as e:
         return jsonify({
             'status': 'error',
@@ -912,26 +2747,372 @@ def get_progress():
             'details': [{'time': datetime.now().strftime('%H:%M:%S'), 'message': f'Error: {str(e)}'}]
         }), 500
 
+@app.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """Get hit/miss counters of the caches in this worker"""
+    return jsonify({name: cache.get_stats() for name, cache in cache_registry.items()})
+
+class SearchJobStore:
+    """Search job records, with the final response payload, in SQLite so any
+    gunicorn worker can answer for a job and jobs survive worker restarts"""
+    
+    def __init__(self):
+        self.table_ready = False
+    
+    def _db(self):
+        conn = get_db()
+        if not self.table_ready:
+            conn.execute('''CREATE TABLE IF NOT EXISTS search_jobs (
+                job_id TEXT PRIMARY KEY,
+                record TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )''')
+            self.table_ready = True
+        return conn
+    
+    def save(self, job):
+        job['updated_at'] = time.time()
+        self._db().execute(
+            'INSERT OR REPLACE INTO search_jobs (job_id, record, updated_at) VALUES (?, ?, ?)',
+            (job['job_id'], json.dumps(job, ensure_ascii=False, default=str), job['updated_at'])
+        )
+    
+    def get(self, job_id):
+        """Job record, or None if unknown"""
+        try:
+            row = self._db().execute('SELECT record, updated_at FROM search_jobs WHERE job_id = ?', (job_id,)).fetchone()
+        except sqlite3.Error as e:
+            print(f'Error reading search job {job_id}: {e}')
+            return None
+        if not row:
+            return None
+        job = json.loads(row[0])
+        job['updated_at'] = row[1]  # Includes heartbeats
+        return job
+    
+    def heartbeat(self, job_ids):
+        """Record that the worker owning these jobs is still alive"""
+        if not job_ids:
+            return
+        try:
+            self._db().execute(
+                f"UPDATE search_jobs SET updated_at = ? WHERE job_id IN ({','.join('?' * len(job_ids))})",
+                [time.time(), *job_ids]
+            )
+        except sqlite3.Error as e:
+            print(f'Error saving search job heartbeat: {e}')
+    
+    def update(self, job_id, **fields):
+        # Only the worker running a job writes it, so read-modify-write is safe
+        try:
+            job = self.get(job_id)
+            if job:
+                job.update(fields)
+                self.save(job)
+        except sqlite3.Error as e:
+            print(f'Error saving search job {job_id}: {e}')
+    
+    def prune(self, max_age):
+        """Forget jobs that haven't been updated for max_age seconds"""
+        try:
+            self._db().execute('DELETE FROM search_jobs WHERE updated_at < ?', (time.time() - max_age,))
+        except sqlite3.Error as e:
+            print(f'Error pruning search jobs: {e}')
+
+search_job_store = SearchJobStore()
+
+# Background search jobs run on this executor; their records live in search_job_store
+search_executor = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix='search-job')
+search_job_heartbeat_thread = None
+search_job_heartbeat_lock = Lock()
+
+def send_search_job_heartbeats():
+    """Keep the records of this worker's unfinished jobs (queued ones too) fresh"""
+    while True:
+        time.sleep(SEARCH_JOB_HEARTBEAT_INTERVAL)
+        job_ids = [job_id for job_id, progress in list(progress_store.jobs.items()) if not progress.finished]
+        search_job_store.heartbeat(job_ids)
+
+def start_search_job_heartbeats():
+    """Start the heartbeat thread of this worker process (after gunicorn forked it)"""
+    global search_job_heartbeat_thread
+    with search_job_heartbeat_lock:
+        if search_job_heartbeat_thread is None:
+            search_job_heartbeat_thread = Thread(target=send_search_job_heartbeats, name='search-job-heartbeat', daemon=True)
+            search_job_heartbeat_thread.start()
+
+def prune_search_jobs():
+    """Forget jobs older than SEARCH_JOB_TTL"""
+    search_job_store.prune(SEARCH_JOB_TTL)
+    progress_store.prune(SEARCH_JOB_TTL)
+
+def create_search_job(search_type, industry, product, industry_filter, region=DEFAULT_SEARCH_REGION):
+    """Queue a search on the background workers and return its job id"""
+    start_search_job_heartbeats()
+    prune_search_jobs()
+    job_id = uuid.uuid4().hex
+    search_job_store.save({
+        'job_id': job_id,
+        'status': 'queued',
+        'search_type': search_type,
+        'query': product if search_type == 'product' else industry,
+        'region': region,
+        'created_at': time.time(),
+        'started_at': None,
+        'finished_at': None,
+        'result': None,
+        'http_status': 200
+    })
+    progress_store.start(job_id)
+    search_executor.submit(run_search_job, job_id, search_type, industry, product, industry_filter, region)
+    return job_id
+
+def update_search_job(job_id, **fields):
+    search_job_store.update(job_id, **fields)
+
+def get_search_job(job_id):
+    """Get a job record from any worker, or None if unknown.
+    
+    An unfinished job whose worker stopped sending heartbeats is reported as failed.
+    """
+    job = search_job_store.get(job_id)
+    if job and job['status'] not in ('completed', 'failed') and time.time() - job['updated_at'] > SEARCH_JOB_LOST_AFTER:
+        job.update(status='failed', http_status=500, result={
+            'error': 'Search job was interrupted, please search again',
+            'companies': [],
+            'count': 0
+        })
+    return job
+
+search_results_cache = TieredCache(
+    'search_results',
+    ttl=SEARCH_CACHE_TTL,
+    stale_ttl=SEARCH_CACHE_STALE_TTL,
+    max_memory_items=SEARCH_CACHE_MEMORY_ITEMS,
+    max_disk_bytes=SEARCH_CACHE_DISK_BYTES
+)
+
+# Cache keys with a background refresh running in this worker
+search_refreshes = set()
+search_refreshes_lock = Lock()
+
+def search_cache_key(search_type, query, industry_filter='', region=DEFAULT_SEARCH_REGION):
+    """Normalized cache key of a search: type, query, industry filter and region, case and spacing ignored"""
+    normalize = lambda text: ' '.join((text or '').lower().split())
+    key = f'{search_type}|{normalize(query)}|{normalize(industry_filter)}'
+    if normalize(region) != normalize(DEFAULT_SEARCH_REGION):
+        key += f'|{normalize(region)}'
+    return key
+
+def run_directory_search(search_type, industry, product, industry_filter, region=DEFAULT_SEARCH_REGION):
+    """Search all providers and cache the final company list if the search found enough"""
+    if search_type == 'product':
+        companies = get_companies_from_directories('', search_type, product, industry_filter, region)
+    else:
+        companies = get_companies_from_directories(industry, search_type, '', '', region)
+    
+    if len(companies) >= 5:
+        query = product if search_type == 'product' else industry
+        search_results_cache.set(search_cache_key(search_type, query, industry_filter, region), companies)
+    return companies
+
+def refresh_cached_search(cache_key, search_type, industry, product, industry_filter, region=DEFAULT_SEARCH_REGION):
+    """Re-run a search in the background to replace its stale cached result"""
+    try:
+        print(f"Refreshing stale search results for {cache_key}")
+        with deadline_scope(SEARCH_TIME_BUDGET):
+            run_directory_search(search_type, industry, product, industry_filter, region)
+    except Exception as e:
+        print(f"Error refreshing search results for {cache_key}: {e}")
+    finally:
+        with search_refreshes_lock:
+            search_refreshes.discard(cache_key)
+
+def cached_directory_search(search_type, industry, product, industry_filter, region=DEFAULT_SEARCH_REGION):
+    """Serve a search from the result cache when possible.
+    
+    Fresh hits are returned as they are. Stale hits are returned too, while a
+    background job (one per key) refreshes them. Misses run the full search.
+    """
+    query = product if search_type == 'product' else industry
+    cache_key = search_cache_key(search_type, query, industry_filter, region)
+    entry = search_results_cache.get_entry(cache_key)
+    if entry is None:
+        return run_directory_search(search_type, industry, product, industry_filter, region)
+    
+    companies, fresh = entry
+    if not fresh:
+        with search_refreshes_lock:
+            start_refresh = cache_key not in search_refreshes
+            search_refreshes.add(cache_key)
+        if start_refresh:
+            # Empty context: the refresh belongs to no job and has its own deadline
+            search_executor.submit(Context().run, refresh_cached_search, cache_key, search_type, industry, product, industry_filter, region)
+    
+    update_progress('found', 'Loaded saved results', len(companies),
+                    f'Using {"saved" if fresh else "saved (refreshing in background)"} results for "{query}"')
+    for company in companies:
+        publish_company(company)
+    return companies
+
+saved_results = TieredCache(
+    'saved_results',
+    ttl=RESULT_TTL,
+    max_memory_items=20,
+    max_disk_bytes=RESULT_DISK_BYTES
+)
+
+def result_id_for(companies):
+    """Content hash of a company list - identical results share one id"""
+    payload = json.dumps(companies, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+def save_search_result(companies, search_query):
+    """Keep a finished result for RESULT_TTL and return its result id"""
+    result_id = result_id_for(companies)
+    saved_results.set(result_id, {'search_query': search_query, 'companies': companies})
+    return result_id
+
+def run_search_job(job_id, search_type, industry, product, industry_filter, region=DEFAULT_SEARCH_REGION):
+    """Run a search on a background worker and store the response payload on the job"""
+    job_token = current_job_id.set(job_id)
+    update_search_job(job_id, status='running', started_at=time.time())
+    try:
+        if search_type == 'product':
+            update_progress('searching', f'Searching for manufacturers of: {product}', 0, f'Looking for companies that manufacture {product}...')
+        else:
+            update_progress('searching', f'Searching for: {industry}', 0, 'Starting company search...')
+        
+        # Get companies based on search type
+        print(f"Starting search job {job_id}: type={search_type}, industry={industry}, product={product}, region={region}")
+        search_start_time = time.time()
+        # One deadline for the whole search; worker threads inherit it with the job id
+        with deadline_scope(SEARCH_TIME_BUDGET):
+            companies = cached_directory_search(search_type, industry, product, industry_filter, region)
+        search_elapsed = time.time() - search_start_time
+        print(f"Search job {job_id} completed: Found {len(companies)} companies in {search_elapsed:.1f}s")
+        
+        # Keep the result server-side so the browser can export it by id
+        result_id = save_search_result(companies, product if search_type == 'product' else industry) if companies else None
+        
+        # Accept fewer companies rather than failing the search
+        if len(companies) < 5:
+            update_progress('warning', 'low_results', len(companies), f'Only found {len(companies)} companies')
+            result = {
+                'error': f'Only found {len(companies)} companies. Please try a different industry or check your API keys.',
+                'companies': companies,
+                'count': len(companies),
+                'result_id': result_id
+            }
+        else:
+            update_progress('completed', 'Search completed successfully', len(companies), f'Found {len(companies)} companies')
+            
+            # Save to search history
+            if search_type == 'product':
+                add_to_history('product', product, industry_filter)
+            else:
+                add_to_history('industry', industry, '')
+            
+            result = {
+                'success': True,
+                'count': len(companies),
+                'companies': companies,
+                'result_id': result_id
+            }
+        
+        update_search_job(job_id, status='completed', result=result, finished_at=time.time())
+        
+    except Exception as e:
+        import traceback
+        print("=" * 50)
+        print(f"ERROR IN SEARCH JOB {job_id}")
+        print(f"Error: {str(e)}")
+        print(traceback.format_exc())
+        print("=" * 50)
+        
+        try:
+            update_progress('error', 'exception', 0, f'Error: {str(e)}')
+        except:
+            pass  # Don't fail if progress update fails
+        
+        update_search_job(job_id, status='failed', finished_at=time.time(), http_status=500, result={
+            'error': str(e),
+            'companies': [],
+            'count': 0,
+            'error_type': type(e).__name__
+        })
+    finally:
+        progress_store.finish(job_id)
+        # The pool thread serves other work next
+        current_job_id.reset(job_token)
+
+def search_job_status(job):
+    """Public view of a job record (without the results)"""
+    result = job['result'] or {}
+    return {
+        'job_id': job['job_id'],
+        'status': job['status'],
+        'search_type': job['search_type'],
+        'query': job['query'],
+        'region': job.get('region', DEFAULT_SEARCH_REGION),
+        'created_at': job['created_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at'],
+        'count': result.get('count', 0),
+        'error': result.get('error', '')
+    }
+
+def stream_search_results(job_id):
+    """Yield a search job's progress and companies as NDJSON records as they happen,
+    ending with a summary record that holds the final, deduplicated result.
+    
+    Progress travels in the same stream so a streaming search holds one connection.
+    """
+    yield json.dumps({'type': 'job', 'job_id': job_id}) + '\n'
+    
+    progress = progress_store.jobs.get(job_id)
+    sent = 0
+    last_event_id = 0
+    last_status = None
+    next_heartbeat = time.time() + SSE_HEARTBEAT_INTERVAL
+    while True:
+        seen_version = progress.version
+        finished = progress.finished  # Set after the job record holds its result
+        
+        updates, last_event_id, last_status = progress_updates(progress.snapshot(), last_event_id, last_status)
+        for update in updates:
+            yield json.dumps({'type': 'progress', **update}, ensure_ascii=False) + '\n'
+        
+        for company in progress.companies[sent:]:
+            yield json.dumps({'type': 'company', 'company': company}, ensure_ascii=False) + '\n'
+            sent += 1
+        
+        if finished:
+            job = get_search_job(job_id)
+            summary = dict(job['result']) if job and job['result'] else {'error': 'Search job expired', 'companies': [], 'count': 0}
+            summary.update(type='summary', job_id=job_id)
+            yield json.dumps(summary, ensure_ascii=False) + '\n'
+            return
+        
+        if time.time() >= next_heartbeat:
+            yield json.dumps({'type': 'heartbeat'}) + '\n'
+            next_heartbeat = time.time() + SSE_HEARTBEAT_INTERVAL
+        
+        progress.wait_for_change(seen_version, max(0.0, next_heartbeat - time.time()))
+
 @app.route('/api/search', methods=['POST'])
 def search_companies():
-    global current_progress
+    """Queue a search and return its job id right away.
+    
+    With "stream": true in the body the response instead streams the job's companies
+    as newline-delimited JSON while the search runs.
+    """
     try:
         # Log that request was received
         print("=== SEARCH REQUEST RECEIVED ===")
         print(f"Request method: {request.method}")
         print(f"Content-Type: {request.content_type}")
         
-        # Reset progress
-        with progress_lock:
-            current_progress = {
-                'status': 'starting',
-                'current_step': 'Initializing search...',
-                'companies_found': 0,
-                'total_steps': 0,
-                'current_step_num': 0,
-                'details': []
-            }
-        
         # Check if request has JSON data
         if not request.is_json:
             print("ERROR: Request is not JSON")
@@ -947,18 +3128,19 @@ def search_companies():
         industry = data.get('industry', '').strip()
         product = data.get('product', '').strip()
         industry_filter = data.get('industry_filter', '').strip()
+        region = (data.get('region') or '').strip() or DEFAULT_SEARCH_REGION
         
         # Validate based on search type
         if search_type == 'product':
             if not product:
-                update_progress('error', 'validation', 0, 'Product name is required')
                 return jsonify({'error': 'Product name is required'}), 400
-            search_query = product
         else:
             if not industry:
-                update_progress('error', 'validation', 0, 'Industry is required')
                 return jsonify({'error': 'Industry is required'}), 400
-            search_query = industry
+        try:
+            parse_region(region)
+        except ValueError as e:
+            return jsonify({'error': f'{e}. Use a country, a province or state, or bbox:south,west,north,east'}), 400
         
         # Check if API keys are configured
         print(f"GOOGLE_PLACES_API_KEY exists: {bool(GOOGLE_PLACES_API_KEY)}")
@@ -967,107 +3149,128 @@ def search_companies():
         
         if not GOOGLE_PLACES_API_KEY and not YELP_API_KEY:
             print("ERROR: No API keys configured")
-            update_progress('error', 'config', 0, 'No API keys configured')
             return jsonify({
                 'error': 'No API keys configured. Please set GOOGLE_PLACES_API_KEY or YELP_API_KEY environment variables. See README.md for instructions.',
                 'companies': []
             }), 400
         
-        if search_type == 'product':
-            update_progress('searching', f'Searching for manufacturers of: {product}', 0, f'Looking for companies that manufacture {product}...')
-        else:
-            update_progress('searching', f'Searching for: {industry}', 0, 'Starting company search...')
-        
-        # Get companies based on search type
-        print(f"Starting search: type={search_type}, industry={industry}, product={product}")
-        search_start_time = time.time()
-        try:
-            if search_type == 'product':
-                companies = get_companies_from_directories('', search_type, product, industry_filter)
-            else:
-                companies = get_companies_from_directories(industry, search_type, '', '')
-            search_elapsed = time.time() - search_start_time
-            print(f"Search completed: Found {len(companies)} companies in {search_elapsed:.1f}s")
-            
-            # If search took too long, return what we have
-            if search_elapsed > 25:
-                print(f"WARNING: Search took {search_elapsed:.1f}s, close to timeout limit")
-        except Exception as search_error:
-            search_elapsed = time.time() - search_start_time
-            print(f"ERROR in get_companies_from_directories after {search_elapsed:.1f}s: {str(search_error)}")
-            import traceback
-            print(traceback.format_exc())
-            # Return empty list instead of raising to avoid timeout
-            companies = []
-        
-        # Accept fewer companies to avoid timeout (reduced from 10 to 5)
-        if len(companies) < 5:
-            update_progress('warning', 'low_results', len(companies), f'Only found {len(companies)} companies')
-            return jsonify({
-                'error': f'Only found {len(companies)} companies. Please try a different industry or check your API keys.',
-                'companies': companies,
-                'count': len(companies)
-            }), 200
-        
-        update_progress('completed', 'Search completed successfully', len(companies), f'Found {len(companies)} companies')
+        job_id = create_search_job(search_type, industry, product, industry_filter, region)
+        print(f"Queued search job {job_id}")
         
-        # Save to search history
-        if search_type == 'product':
-            add_to_history('product', product, industry_filter)
-        else:
-            add_to_history('industry', industry, '')
+        if data.get('stream'):
+            return Response(
+                stream_with_context(stream_search_results(job_id)),
+                mimetype='application/x-ndjson',
+                headers={
+                    'Cache-Control': 'no-cache',
+                    'X-Accel-Buffering': 'no'  # Don't let proxies buffer the stream
+                }
+            )
         
         return jsonify({
             'success': True,
-            'count': len(companies),
-            'companies': companies
-        })
+            'job_id': job_id,
+            'status': 'queued',
+            'status_url': f'/api/search/{job_id}',
+            'results_url': f'/api/search/{job_id}/results'
+        }), 202
         
     except Exception as e:
         import traceback
-        error_trace = traceback.format_exc()
         print("=" * 50)
         print("ERROR IN SEARCH_COMPANIES")
         print(f"Error: {str(e)}")
-        print(f"Type: {type(e).__name__}")
-        print("Traceback:")
-        print(error_trace)
+        print(traceback.format_exc())
         print("=" * 50)
-        
-        try:
-            update_progress('error', 'exception', 0, f'Error: {str(e)}')
-        except:
-            pass  # Don't fail if progress update fails
-        
-        # Always return valid JSON, even on error
-        try:
-            return jsonify({
-                'error': str(e),
-                'companies': [],
-                'count': 0,
-                'error_type': type(e).__name__
-            }), 500
-        except Exception as json_error:
-            # Last resort - return simple text response
-            print(f"CRITICAL: Could not return JSON error: {json_error}")
-            return f"Error: {str(e)}", 500, {'Content-Type': 'text/plain'}
+        return jsonify({
+            'error': str(e),
+            'companies': [],
+            'count': 0,
+            'error_type': type(e).__name__
+        }), 500
+
+@app.route('/api/search/<job_id>', methods=['GET'])
+def get_search_status(job_id):
+    """Get the status of a search job"""
+    job = get_search_job(job_id)
+    if not job:
+        return jsonify({'error': 'Unknown search job'}), 404
+    return jsonify(search_job_status(job))
+
+@app.route('/api/search/<job_id>/events', methods=['GET'])
+def get_search_events(job_id):
+    """Stream a search job's progress as Server-Sent Events"""
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id', '0')
+    try:
+        last_event_id = int(last_event_id)
+    except ValueError:
+        last_event_id = 0
+    
+    return Response(
+        stream_with_context(stream_progress_events(job_id, last_event_id)),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # Don't let proxies buffer the stream
+        }
+    )
+
+@app.route('/api/search/<job_id>/results', methods=['GET'])
+def get_search_results(job_id):
+    """Get the results of a finished search job (202 while it is still running)"""
+    job = get_search_job(job_id)
+    if not job:
+        return jsonify({'error': 'Unknown search job'}), 404
+    if job['status'] not in ('completed', 'failed'):
+        return jsonify(search_job_status(job)), 202
+    return jsonify(job['result']), job['http_status']
 
 @app.route('/api/history', methods=['GET'])
 def get_history():
-    """Get all search history"""
+    """Get one page of search history (?type=, ?limit=, ?cursor=).
+    
+    Answers 304 without a body when the client's copy (ETag / Last-Modified) is current.
+    """
     try:
         search_type = request.args.get('type', None)  # Optional filter by type
-        history = get_search_history()
-        
-        # Filter by type if specified
-        if search_type:
-            history = [item for item in history if item.get('type') == search_type]
+        cursor = request.args.get('cursor', None)
+        try:
+            limit = max(1, min(int(request.args.get('limit', HISTORY_PAGE_SIZE)), MAX_HISTORY_ITEMS))
+            if cursor:
+                decode_history_cursor(cursor)
+        except ValueError as e:
+            return jsonify({'error': f'Invalid parameter: {e}'}), 400
+        
+        total, last_updated = get_history_version(search_type)
+        etag = hashlib.md5(f'{search_type}|{limit}|{cursor}|{total}|{last_updated!r}'.encode()).hexdigest()
+        # Last-Modified has whole seconds: round up, and leave it out while the history changed
+        # less than a second ago - a later write in the same second would carry the same date
+        last_modified = None
+        if last_updated and time.time() - last_updated >= 1:
+            last_modified = datetime.fromtimestamp(math.ceil(last_updated), tz=timezone.utc)
+        
+        not_modified = request.if_none_match.contains(etag) if request.if_none_match else (
+            last_modified is not None and request.if_modified_since is not None
+            and last_modified <= request.if_modified_since
+        )
+        if not_modified:
+            response = Response(status=304)
+        else:
+            history, next_cursor = get_search_history_page(search_type, limit, cursor)
+            response = jsonify({
+                'success': True,
+                'history': history,
+                'count': len(history),
+                'total': total,
+                'next_cursor': next_cursor
+            })
         
-        return jsonify({
-            'success': True,
-            'history': history,
-            'count': len(history)
-        })
+        response.set_etag(etag)
+        if last_modified:
+            response.last_modified = last_modified
+        # Let browsers keep the response but always revalidate it
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -1092,44 +3295,178 @@ def save_history():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Export columns come first in this order, any other fields follow in the order they first appear
+EXPORT_COLUMN_ORDER = ['name', 'industry', 'business_type', 'address', 'phone', 'email', 'website', 'employee_count', 'revenue', 'rating', 'country']
+EXPORT_FORMATS = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'text/csv',
+}
+EXPORT_CSV_BATCH_ROWS = 500  # CSV rows encoded per chunk
+
+def export_columns(companies):
+    """Work out the export columns from the fields present in the companies"""
+    seen = {}
+    for company in companies:
+        for key in company:
+            seen.setdefault(key, None)
+    return [col for col in EXPORT_COLUMN_ORDER if col in seen] + [col for col in seen if col not in EXPORT_COLUMN_ORDER]
+
+def export_cell(value):
+    """Turn a company field into a value a spreadsheet cell can hold"""
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+def iter_export_rows(companies, columns):
+    """Yield one row of cell values per company, in column order"""
+    for company in companies:
+        yield [export_cell(company.get(col)) for col in columns]
+
+def export_filename(search_query, extension):
+    """Build a download filename from the search query and the current time"""
+    # Sanitize search query for filename (remove invalid characters)
+    sanitized_query = re.sub(r'[<>:"/\\|?*]', '', search_query)
+    sanitized_query = re.sub(r'\s+', '_', sanitized_query.strip())
+    sanitized_query = sanitized_query[:50]  # Limit length to 50 characters
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    return f'{sanitized_query}_{timestamp}.{extension}'
+
+def stream_csv(companies, columns):
+    """Encode companies as CSV a batch of rows at a time"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for index, row in enumerate(iter_export_rows(companies, columns), 1):
+        writer.writerow(['' if value is None else value for value in row])
+        if index % EXPORT_CSV_BATCH_ROWS == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+def write_xlsx(companies, columns, filepath):
+    """Write companies into a write-only workbook at filepath"""
+    # Write-only sheets serialize each row as it is appended instead of keeping cell objects
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(columns)
+    for row in iter_export_rows(companies, columns):
+        sheet.append(row)
+    workbook.save(filepath)
+
+def write_csv(companies, columns, filepath):
+    """Write companies to a CSV file at filepath, a batch of rows at a time"""
+    with open(filepath, 'wb') as f:
+        for chunk in stream_csv(companies, columns):
+            f.write(chunk)
+
+def prune_export_cache(keep=None):
+    """Delete the least recently used export files until the cache fits EXPORT_CACHE_MAX_BYTES,
+    and unfinished ones that nobody has written to for EXPORT_PARTIAL_MAX_AGE"""
+    files = []
+    total = 0
+    now = time.time()
+    for entry in os.scandir(EXPORT_CACHE_DIR):
+        if not entry.is_file():
+            continue
+        try:
+            stat = entry.stat()
+            if entry.name.startswith('partial_'):
+                # Still being written, or abandoned by a worker killed mid-write
+                if now - stat.st_mtime > EXPORT_PARTIAL_MAX_AGE:
+                    os.remove(entry.path)
+                continue
+        except FileNotFoundError:
+            continue  # Removed by another worker
+        files.append((stat.st_mtime, stat.st_size, entry.path))
+        total += stat.st_size
+    
+    for mtime, size, path in sorted(files):
+        if total <= EXPORT_CACHE_MAX_BYTES:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+def get_export_file(result_id, companies, export_format):
+    """Path of the export file for a result, generated on the first request.
+    
+    Files are named by result id (a content hash) and format, so identical
+    exports are served from disk. A hit bumps the file's mtime for LRU eviction.
+    """
+    filepath = os.path.join(EXPORT_CACHE_DIR, f'{result_id}.{export_format}')
+    try:
+        os.utime(filepath)
+        return filepath
+    except FileNotFoundError:
+        pass
+    
+    os.makedirs(EXPORT_CACHE_DIR, exist_ok=True)
+    fd, partial_path = tempfile.mkstemp(prefix='partial_', suffix=f'.{export_format}', dir=EXPORT_CACHE_DIR)
+    os.close(fd)
+    try:
+        columns = export_columns(companies)
+        if export_format == 'csv':
+            write_csv(companies, columns, partial_path)
+        else:
+            write_xlsx(companies, columns, partial_path)
+        # Atomic, so other workers never serve a half-written file
+        os.replace(partial_path, filepath)
+    except Exception:
+        os.remove(partial_path)
+        raise
+    
+    prune_export_cache(keep=filepath)
+    return filepath
+
+def export_response(result_id, companies, search_query, export_format):
+    """Send a saved result as an XLSX or CSV download"""
+    filepath = get_export_file(result_id, companies, export_format)
+    return send_file(
+        filepath,
+        mimetype=EXPORT_FORMATS[export_format],
+        as_attachment=True,
+        download_name=export_filename(search_query, export_format),
+        max_age=0
+    )
+
+@app.route('/api/export/<result_id>', methods=['GET'])
+def export_result(result_id):
+    """Export a saved search result (?format=xlsx|csv)"""
+    try:
+        export_format = request.args.get('format', 'xlsx').lower()
+        if export_format not in EXPORT_FORMATS:
+            return jsonify({'error': f'Unsupported export format: {export_format}'}), 400
+        
+        saved = saved_results.get(result_id)
+        if saved is None:
+            return jsonify({'error': 'These results have expired. Please search again.'}), 404
+        
+        return export_response(result_id, saved['companies'], saved['search_query'] or 'companies', export_format)
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/export', methods=['POST'])
 def export_to_excel():
+    """Export companies sent in the request body (clients without a result id)"""
     try:
         data = request.json
         companies = data.get('companies', [])
         search_query = data.get('search_query', 'companies')
+        export_format = (data.get('format') or request.args.get('format') or 'xlsx').lower()
         
         if not companies:
             return jsonify({'error': 'No companies to export'}), 400
+        if export_format not in EXPORT_FORMATS:
+            return jsonify({'error': f'Unsupported export format: {export_format}'}), 400
         
-        # Create DataFrame
-        df = pd.DataFrame(companies)
-        
-        # Reorder columns (include Apollo.io fields if available)
-        column_order = ['name', 'industry', 'business_type', 'address', 'phone', 'email', 'website', 'employee_count', 'revenue', 'rating', 'country']
-        # Only include columns that exist in the dataframe
-        available_columns = [col for col in column_order if col in df.columns]
-        # Add any other columns that weren't in the order
-        other_columns = [col for col in df.columns if col not in column_order]
-        df = df[available_columns + other_columns]
-        
-        # Sanitize search query for filename (remove invalid characters)
-        sanitized_query = re.sub(r'[<>:"/\\|?*]', '', search_query)
-        sanitized_query = re.sub(r'\s+', '_', sanitized_query.strip())
-        sanitized_query = sanitized_query[:50]  # Limit length to 50 characters
-        
-        # Generate filename with search query
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f'{sanitized_query}_{timestamp}.xlsx'
-        filepath = os.path.join('exports', filename)
-        
-        # Create exports directory if it doesn't exist
-        os.makedirs('exports', exist_ok=True)
-        
-        # Export to Excel
-        df.to_excel(filepath, index=False, engine='openpyxl')
-        
-        return send_file(filepath, as_attachment=True, download_name=filename)
+        result_id = save_search_result(companies, search_query)
+        return export_response(result_id, companies, search_query, export_format)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -0,0 +1,106 @@
+"""
+Benchmark the compiled relevance classifier against the original implementation
+
+Checks that is_transportation_relevant_company() and classify_places() make
+the same decision as the original implementation for every sample place, and
+times them.
+
+Usage: python benchmark_relevance.py [number_of_places]
+"""
+import random
+import sys
+import time
+
+from app import (
+    EXCLUDED_TYPES, PRIORITY_TYPES, TRANSPORTATION_KEYWORDS,
+    classify_places, is_transportation_relevant_company
+)
+
+def legacy_is_transportation_relevant_company(place_data, company_name='', address=''):
+    """The classifier as it was before the rules were compiled"""
+    types = place_data.get('types', [])
+    business_status = place_data.get('business_status', '')
+
+    for excluded_type in EXCLUDED_TYPES:
+        if excluded_type in types:
+            return False
+
+    for priority_type in PRIORITY_TYPES:
+        if priority_type in types:
+            return True
+
+    name_lower = company_name.lower()
+    address_lower = address.lower()
+    combined_text = f"{name_lower} {address_lower}"
+
+    for keyword in TRANSPORTATION_KEYWORDS:
+        if keyword in combined_text:
+            return True
+
+    retail_indicators = ['store', 'shop', 'retail', 'outlet', 'mall']
+    if any(indicator in name_lower for indicator in retail_indicators):
+        if 'wholesale' not in name_lower and 'distribution' not in name_lower:
+            return False
+
+    if business_status and business_status != 'OPERATIONAL':
+        return False
+
+    return 'establishment' in types or 'point_of_interest' in types
+
+NAME_WORDS = [
+    'Acme', 'Northern', 'Maple', 'Pacific', 'Summit', 'Harbor', 'Prairie', 'Atlas',
+    'Bakery', 'Shop', 'Outlet', 'Wholesale', 'Freight', 'Logistics', 'Foods', 'Tools',
+    'Steel', 'Plastics', 'Retail', 'Mall', 'Supply Chain', 'Distribution', 'Studio', 'Group'
+]
+OTHER_TYPES = ['establishment', 'point_of_interest', 'car_repair', 'lawyer', 'storage', 'moving_company', 'electrician']
+STREETS = ['Main St', 'Industrial Pkwy', 'Harbour Rd', 'Export Ave', 'King St W', 'Warehouse Ln', 'Queen St']
+STATUSES = ['OPERATIONAL', 'OPERATIONAL', 'OPERATIONAL', 'CLOSED_TEMPORARILY', 'CLOSED_PERMANENTLY', '']
+
+def sample_place(rng):
+    """A random place shaped like a Google Places (or Apollo) search result"""
+    types = rng.sample(EXCLUDED_TYPES + PRIORITY_TYPES + OTHER_TYPES * 4, rng.randint(0, 4))
+    if rng.random() < 0.1:
+        # Apollo passes its industry as a string, which is matched by substring
+        types = ' '.join(types)
+    place = {
+        'name': ' '.join(rng.sample(NAME_WORDS, rng.randint(1, 3))),
+        'formatted_address': f"{rng.randint(1, 9999)} {rng.choice(STREETS)}, Toronto, ON",
+        'types': types,
+    }
+    status = rng.choice(STATUSES)
+    if status:
+        place['business_status'] = status
+    return place
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rng = random.Random(42)
+    places = [sample_place(rng) for _ in range(count)]
+
+    start = time.perf_counter()
+    legacy = [legacy_is_transportation_relevant_company(place, place.get('name', ''), place.get('formatted_address', '')) for place in places]
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    single = [is_transportation_relevant_company(place, place.get('name', ''), place.get('formatted_address', '')) for place in places]
+    single_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    listed = classify_places(places)
+    list_time = time.perf_counter() - start
+
+    mismatches = [place for place, old, new in zip(places, legacy, listed) if old != new]
+    mismatches += [place for place, old, new in zip(places, legacy, single) if old != new]
+
+    print(f"Places classified:  {count} ({sum(listed)} relevant)")
+    print(f"Legacy:             {legacy_time * 1000:.1f} ms")
+    print(f"Compiled (single):  {single_time * 1000:.1f} ms ({legacy_time / single_time:.1f}x)")
+    print(f"classify_places():  {list_time * 1000:.1f} ms ({legacy_time / list_time:.1f}x)")
+
+    if mismatches:
+        print(f"[ERROR] {len(mismatches)} decisions differ, first: {mismatches[0]}")
+        sys.exit(1)
+    print("[OK] All decisions match")
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,35 @@
 let currentCompanies = [];
 let currentSearchType = 'industry';
 let currentSearchQuery = '';
+let currentResultId = null; // Server-side id of the current results, used for export
+
+const HISTORY_PAGE_SIZE = 50;
 
 // Search History Management - Server-side storage
-async function getSearchHistory(searchType = null) {
+async function fetchHistoryPage(searchType = null, limit = HISTORY_PAGE_SIZE, cursor = null) {
+    // The server sends ETag/Last-Modified with no-cache, so the browser revalidates
+    // and unchanged history comes back as an empty 304
+    const params = new URLSearchParams({ limit: String(limit) });
+    if (searchType) {
+        params.set('type', searchType);
+    }
+    if (cursor) {
+        params.set('cursor', cursor);
+    }
+    const response = await fetch(`/api/history?${params}`);
+    if (!response.ok) {
+        throw new Error('Failed to fetch history');
+    }
+    return response.json();
+}
+
+async function getHistoryCount(searchType) {
     try {
-        const url = searchType ? `/api/history?type=${searchType}` : '/api/history';
-        const response = await fetch(url);
-        if (!response.ok) {
-            throw new Error('Failed to fetch history');
-        }
-        const data = await response.json();
-        return data.history || [];
+        const data = await fetchHistoryPage(searchType, 1);
+        return data.total || 0;
     } catch (e) {
         console.error('Error reading search history:', e);
-        return [];
+        return 0;
     }
 }
 
@@ -71,14 +86,14 @@ function formatDate(timestamp) {
 
 async function updateHistoryButtons() {
     try {
-        const industryHistory = await getSearchHistory('industry');
-        const productHistory = await getSearchHistory('product');
+        const industryCount = await getHistoryCount('industry');
+        const productCount = await getHistoryCount('product');
         
         const industryBtn = document.getElementById('industryHistoryBtn');
         const productBtn = document.getElementById('productHistoryBtn');
         
         if (industryBtn) {
-            const count = industryHistory.length;
+            const count = industryCount;
             const countBadge = industryBtn.querySelector('.history-count');
             if (count > 0) {
                 if (!countBadge) {
@@ -93,7 +108,7 @@ async function updateHistoryButtons() {
         }
         
         if (productBtn) {
-            const count = productHistory.length;
+            const count = productCount;
             const countBadge = productBtn.querySelector('.history-count');
             if (count > 0) {
                 if (!countBadge) {
@@ -116,45 +131,67 @@ async function renderHistory() {
     const currentType = currentSearchType;
     
     try {
-        // Fetch history from server filtered by current type
-        const filteredHistory = await getSearchHistory(currentType);
+        // Fetch the first page of history from server filtered by current type
+        const page = await fetchHistoryPage(currentType);
         
-        if (filteredHistory.length === 0) {
+        if (page.history.length === 0) {
             historyList.innerHTML = '<div class="history-empty">No search history yet</div>';
             return;
         }
+        
+        historyList.innerHTML = '';
+        appendHistoryItems(historyList, page.history, page.next_cursor, currentType);
+    } catch (e) {
+        console.error('Error rendering history:', e);
+        historyList.innerHTML = '<div class="history-empty">Error loading history</div>';
+    }
+}
+
+function appendHistoryItems(historyList, items, nextCursor, searchType) {
+    const loadMoreBtn = historyList.querySelector('.history-load-more');
+    if (loadMoreBtn) {
+        loadMoreBtn.remove();
+    }
     
-        historyList.innerHTML = filteredHistory.map(item => {
-            return `
-            <div class="history-item" data-id="${item.id}">
-                <div class="history-item-content">
-                    <div class="history-item-query">${escapeHtml(item.query || '')}</div>
-                    <div class="history-item-meta">
-                        <span class="history-item-type">${item.type || 'unknown'}</span>
-                        ${item.industry_filter ? `<span>Filter: ${escapeHtml(item.industry_filter)}</span>` : ''}
-                        <span class="history-item-date">${formatDate(item.timestamp)}</span>
-                    </div>
+    items.forEach(historyItem => {
+        const item = document.createElement('div');
+        item.className = 'history-item';
+        item.dataset.id = historyItem.id;
+        item.innerHTML = `
+            <div class="history-item-content">
+                <div class="history-item-query">${escapeHtml(historyItem.query || '')}</div>
+                <div class="history-item-meta">
+                    <span class="history-item-type">${historyItem.type || 'unknown'}</span>
+                    ${historyItem.industry_filter ? `<span>Filter: ${escapeHtml(historyItem.industry_filter)}</span>` : ''}
+                    <span class="history-item-date">${formatDate(historyItem.timestamp)}</span>
                 </div>
             </div>
         `;
-        }).join('');
         
-        // Add click handlers to history items
-        historyList.querySelectorAll('.history-item').forEach(item => {
-            const itemId = parseInt(item.dataset.id);
-            const historyItem = filteredHistory.find(h => h.id === itemId);
-            
-            // Item click handler (select from history)
-            item.addEventListener('click', function(e) {
-                if (historyItem) {
-                    selectFromHistory(historyItem);
-                    closeHistoryModal();
-                }
-            });
+        // Item click handler (select from history)
+        item.addEventListener('click', function() {
+            selectFromHistory(historyItem);
+            closeHistoryModal();
         });
-    } catch (e) {
-        console.error('Error rendering history:', e);
-        historyList.innerHTML = '<div class="history-empty">Error loading history</div>';
+        historyList.appendChild(item);
+    });
+    
+    if (nextCursor) {
+        const button = document.createElement('button');
+        button.className = 'history-load-more';
+        button.textContent = 'Load more';
+        button.addEventListener('click', async function(e) {
+            e.stopPropagation();
+            button.disabled = true;
+            try {
+                const page = await fetchHistoryPage(searchType, HISTORY_PAGE_SIZE, nextCursor);
+                appendHistoryItems(historyList, page.history, page.next_cursor, searchType);
+            } catch (err) {
+                console.error('Error loading more history:', err);
+                button.disabled = false;
+            }
+        });
+        historyList.appendChild(button);
     }
 }
 
@@ -301,7 +338,16 @@ document.getElementById('productIndustry').addEventListener('keypress', function
     }
 });
 
+document.getElementById('region').addEventListener('keypress', function(e) {
+    if (e.key === 'Enter') {
+        searchCompanies();
+    }
+});
+
 let progressInterval = null;
+let progressSource = null;
+let progressDetails = [];
+let currentJobId = null;
 
 async function searchCompanies() {
     let searchQuery = '';
@@ -343,8 +389,7 @@ async function searchCompanies() {
         progressBox.innerHTML = '';
     }
     
-    // Start progress polling - reduced frequency to avoid overwhelming server
-    progressInterval = setInterval(updateProgress, 1000); // Update every 1 second
+    currentJobId = null;
     
     try {
         const requestBody = searchType === 'industry' 
@@ -354,47 +399,60 @@ async function searchCompanies() {
                 search_type: 'product',
                 industry_filter: document.getElementById('productIndustry').value.trim() || ''
               };
+        const region = document.getElementById('region').value.trim();
+        if (region) {
+            requestBody.region = region;
+        }
         
+        // Queue the search. Where the browser can read a response as it arrives, the server
+        // streams each company as soon as it is found; otherwise it answers with a job id.
+        const canStream = Boolean(window.ReadableStream && window.TextDecoder);
         const response = await fetch('/api/search', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json'
             },
-            body: JSON.stringify(requestBody)
+            body: JSON.stringify({ ...requestBody, stream: canStream })
         });
         
-        // Check if response has content before parsing JSON
-        const responseText = await response.text();
-        if (!responseText || responseText.trim() === '') {
-            throw new Error('Empty response from server. Please check Render logs for errors.');
-        }
-        
         let data;
-        try {
-            data = JSON.parse(responseText);
-        } catch (parseError) {
-            console.error('Failed to parse JSON response:', responseText);
-            throw new Error('Invalid response from server. Please check Render logs. Response: ' + responseText.substring(0, 200));
-        }
-        
-        // Stop progress polling
-        if (progressInterval) {
-            clearInterval(progressInterval);
-            progressInterval = null;
-        }
-        
-        if (!response.ok) {
-            throw new Error(data.error || 'Failed to search companies');
+        const contentType = response.headers.get('Content-Type') || '';
+        if (response.ok && response.body && contentType.includes('ndjson')) {
+            const streamed = await readSearchStream(response);
+            data = streamed.summary;
+            stopProgress();
+            if (data.error_type) {
+                throw new Error(data.error || 'Failed to search companies');
+            }
+        } else {
+            const job = await parseJsonResponse(response);
+            if (!response.ok) {
+                throw new Error(job.error || 'Failed to start search');
+            }
+            currentJobId = job.job_id;
+            
+            // Follow progress as it happens and wait for the background search to finish
+            const searchDone = watchProgress(job.job_id);
+            const results = await waitForSearchJob(job.job_id, searchDone);
+            data = results.data;
+            stopProgress();
+            
+            if (!results.response.ok) {
+                throw new Error(data.error || 'Failed to search companies');
+            }
         }
         
         if (data.error && data.companies.length < 10) {
             showError(data.error);
             if (data.companies.length > 0) {
                 currentCompanies = data.companies;
-                displayResults(data.companies, data.count);
+                currentResultId = data.result_id || null;
+                currentSearchQuery = searchQuery;
+                showFinalResults(data.companies, data.count);
             }
         } else {
             currentCompanies = data.companies;
+            currentResultId = data.result_id || null;
             currentSearchQuery = searchQuery; // Store the search query for export
             
             // Save to search history (server-side)
@@ -404,14 +462,11 @@ async function searchCompanies() {
             // Don't await - let it save in background
             addToHistory(searchType, searchQuery, industryFilter);
             
-            displayResults(data.companies, data.count);
+            showFinalResults(data.companies, data.count);
         }
         
     } catch (error) {
-        if (progressInterval) {
-            clearInterval(progressInterval);
-            progressInterval = null;
-        }
+        stopProgress();
         showError('Error searching for companies: ' + error.message);
     } finally {
         document.getElementById('loading').classList.add('hidden');
@@ -420,111 +475,262 @@ async function searchCompanies() {
     }
 }
 
-async function updateProgress() {
+async function parseJsonResponse(response) {
+    // Check if response has content before parsing JSON
+    const responseText = await response.text();
+    if (!responseText || responseText.trim() === '') {
+        throw new Error('Empty response from server. Please check Render logs for errors.');
+    }
+    
     try {
-        const response = await fetch('/api/progress');
-        if (!response.ok) {
-            return; // Silently fail if there's an error
+        return JSON.parse(responseText);
+    } catch (parseError) {
+        console.error('Failed to parse JSON response:', responseText);
+        throw new Error('Invalid response from server. Please check Render logs. Response: ' + responseText.substring(0, 200));
+    }
+}
+
+async function readSearchStream(response) {
+    // Read newline-delimited JSON records: the job id, then companies as they are found,
+    // then a summary with the final (deduplicated) results
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let count = 0;
+    let summary = null;
+    
+    const handleLine = line => {
+        if (!line.trim()) {
+            return;
         }
-        
-        const progress = await response.json();
-        
-        const progressBox = document.getElementById('progressBox');
-        if (!progressBox) return;
-        
-        // Update status
-        const statusText = document.getElementById('progressStatus');
-        if (statusText) {
-            statusText.textContent = progress.current_step || progress.status || 'Searching...';
+        const record = JSON.parse(line);
+        if (record.type === 'job') {
+            // Progress arrives in this stream too, so no separate progress connection
+            currentJobId = record.job_id;
+            stopProgress();
+            progressDetails = [];
+        } else if (record.type === 'progress') {
+            applyProgressUpdate(record);
+        } else if (record.type === 'company') {
+            if (count === 0) {
+                startResults();
+            }
+            appendCompanyCard(record.company, count);
+            count += 1;
+            document.getElementById('count').textContent = count;
+        } else if (record.type === 'summary') {
+            summary = record;
         }
-        
-        // Update companies count
-        const countText = document.getElementById('progressCount');
-        if (countText) {
-            countText.textContent = progress.companies_found || 0;
+    };
+    
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) {
+            break;
         }
-        
-        // Update details log
-        const detailsBox = document.getElementById('progressDetails');
-        if (detailsBox && progress.details && progress.details.length > 0) {
-            const recentDetails = progress.details.slice(-15); // Show last 15
-            detailsBox.innerHTML = recentDetails.map(d => {
-                const message = escapeHtml(d.message || '');
-                let className = 'progress-detail';
-                if (message.toLowerCase().includes('found:')) {
-                    className += ' progress-found';
-                } else if (message.toLowerCase().includes('error') || message.toLowerCase().includes('timeout')) {
-                    className += ' progress-error';
-                } else if (message.toLowerCase().includes('skipped')) {
-                    className += ' progress-warning';
-                }
-                return `<div class="${className}">[${d.time || ''}] ${message}</div>`;
-            }).join('');
-            // Auto-scroll to bottom
-            detailsBox.scrollTop = detailsBox.scrollHeight;
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+        lines.forEach(handleLine);
+    }
+    handleLine(buffer + decoder.decode());
+    
+    if (!summary) {
+        throw new Error('Search stream ended unexpectedly. Please check Render logs for errors.');
+    }
+    return { summary, count };
+}
+
+function sleep(ms) {
+    return new Promise(resolve => setTimeout(resolve, ms));
+}
+
+async function waitForSearchJob(jobId, searchDone) {
+    // The results endpoint answers 202 until the job has finished. With a progress stream
+    // we only ask once it reports the job as done (re-checking now and then in case the
+    // stream is lost); without one we poll every second.
+    while (true) {
+        if (searchDone) {
+            await Promise.race([searchDone, sleep(10000)]);
+        } else {
+            await sleep(1000);
+        }
+        const response = await fetch(`/api/search/${jobId}/results`);
+        if (response.status === 202) {
+            continue;
         }
+        const data = await parseJsonResponse(response);
+        return { response, data };
+    }
+}
+
+function watchProgress(jobId) {
+    // Returns a promise that resolves when the server reports the job as done,
+    // or null when progress has to be polled
+    stopProgress();
+    progressDetails = [];
+    
+    if (!window.EventSource) {
+        progressInterval = setInterval(updateProgress, 1000); // Update every 1 second
+        return null;
+    }
+    
+    return new Promise(resolve => {
+        // EventSource reconnects by itself and resumes from the last event id it received
+        progressSource = new EventSource(`/api/search/${encodeURIComponent(jobId)}/events`);
         
-        // Update progress bar if exists
-        const progressBar = document.getElementById('progressBar');
-        if (progressBar && progress.total_steps > 0) {
-            const percent = Math.min(100, (progress.current_step_num / progress.total_steps) * 100);
-            progressBar.style.width = percent + '%';
-        } else if (progressBar && progress.companies_found > 0) {
-            // Show some progress based on companies found (rough estimate)
-            const estimatedPercent = Math.min(90, progress.companies_found * 2); // Rough estimate
-            progressBar.style.width = estimatedPercent + '%';
+        const handleUpdate = event => applyProgressUpdate(JSON.parse(event.data));
+        
+        progressSource.addEventListener('progress', handleUpdate);
+        progressSource.addEventListener('done', event => {
+            handleUpdate(event);
+            stopProgress();
+            resolve();
+        });
+    });
+}
+
+function applyProgressUpdate(update) {
+    if (update.detail) {
+        progressDetails.push(update.detail);
+        progressDetails = progressDetails.slice(-15);
+    }
+    renderProgress({ ...update, details: progressDetails });
+}
+
+function stopProgress() {
+    if (progressSource) {
+        progressSource.close();
+        progressSource = null;
+    }
+    if (progressInterval) {
+        clearInterval(progressInterval);
+        progressInterval = null;
+    }
+}
+
+async function updateProgress() {
+    if (!currentJobId) {
+        return; // Search not queued yet
+    }
+    
+    try {
+        const response = await fetch(`/api/progress?job_id=${encodeURIComponent(currentJobId)}`);
+        if (!response.ok) {
+            return; // Silently fail if there's an error
         }
         
+        renderProgress(await response.json());
     } catch (error) {
         // Silently fail - progress is optional, don't spam console
         console.debug('Progress update failed:', error);
     }
 }
 
-function displayResults(companies, count) {
-    document.getElementById('count').textContent = count;
+function renderProgress(progress) {
+    const progressBox = document.getElementById('progressBox');
+    if (!progressBox) return;
+    
+    // Update status
+    const statusText = document.getElementById('progressStatus');
+    if (statusText) {
+        statusText.textContent = progress.current_step || progress.status || 'Searching...';
+    }
+    
+    // Update companies count
+    const countText = document.getElementById('progressCount');
+    if (countText) {
+        countText.textContent = progress.companies_found || 0;
+    }
+    
+    // Update details log
+    const detailsBox = document.getElementById('progressDetails');
+    if (detailsBox && progress.details && progress.details.length > 0) {
+        const recentDetails = progress.details.slice(-15); // Show last 15
+        detailsBox.innerHTML = recentDetails.map(d => {
+            const message = escapeHtml(d.message || '');
+            let className = 'progress-detail';
+            if (message.toLowerCase().includes('found:')) {
+                className += ' progress-found';
+            } else if (message.toLowerCase().includes('error') || message.toLowerCase().includes('timeout')) {
+                className += ' progress-error';
+            } else if (message.toLowerCase().includes('skipped')) {
+                className += ' progress-warning';
+            }
+            return `<div class="${className}">[${d.time || ''}] ${message}</div>`;
+        }).join('');
+        // Auto-scroll to bottom
+        detailsBox.scrollTop = detailsBox.scrollHeight;
+    }
+    
+    // Update progress bar if exists
+    const progressBar = document.getElementById('progressBar');
+    if (progressBar && progress.total_steps > 0) {
+        const percent = Math.min(100, (progress.current_step_num / progress.total_steps) * 100);
+        progressBar.style.width = percent + '%';
+    } else if (progressBar && progress.companies_found > 0) {
+        // Show some progress based on companies found (rough estimate)
+        const estimatedPercent = Math.min(90, progress.companies_found * 2); // Rough estimate
+        progressBar.style.width = estimatedPercent + '%';
+    }
+}
+
+function showFinalResults(companies, count) {
+    // Streamed rows are provisional: the final list is deduplicated and ranked by lead score
+    displayResults(companies, count);
+}
+
+function startResults() {
     const resultsEl = document.getElementById('results');
     resultsEl.classList.remove('hidden');
-    
-    const companiesList = document.getElementById('companiesList');
-    companiesList.innerHTML = '';
+    document.getElementById('companiesList').innerHTML = '';
     
     // Smooth scroll to results
     setTimeout(() => {
         resultsEl.scrollIntoView({ behavior: 'smooth', block: 'nearest' });
     }, 100);
+}
+
+function displayResults(companies, count) {
+    document.getElementById('count').textContent = count;
+    startResults();
     
     companies.forEach((company, index) => {
-        const card = document.createElement('div');
-        card.className = 'company-card';
-        card.style.opacity = '0';
-        card.style.transform = 'translateY(20px)';
-        
-        const countryClass = company.country === 'Canada' ? 'country-canada' : 'country-usa';
-        
-        card.innerHTML = `
-            <div class="company-name">${escapeHtml(company.name)}</div>
-            <div class="company-detail"><strong>Industry:</strong> ${escapeHtml(company.industry)}</div>
-            ${company.business_type ? `<div class="company-detail"><strong>Type:</strong> ${escapeHtml(company.business_type)}</div>` : ''}
-            <div class="company-detail"><strong>Address:</strong> ${escapeHtml(company.address || 'N/A')}</div>
-            ${company.phone ? `<div class="company-detail"><strong>Phone:</strong> <a href="tel:${escapeHtml(company.phone)}">${escapeHtml(company.phone)}</a></div>` : ''}
-            ${company.email ? `<div class="company-detail"><strong>Email:</strong> <a href="mailto:${escapeHtml(company.email)}">${escapeHtml(company.email)}</a></div>` : ''}
-            ${company.website ? `<div class="company-detail"><strong>Website:</strong> <a href="${escapeHtml(company.website)}" target="_blank">Visit</a></div>` : ''}
-            ${company.rating ? `<div class="company-detail"><strong>Rating:</strong> ${company.rating}/5</div>` : ''}
-            <span class="country-badge ${countryClass}">${escapeHtml(company.country)}</span>
-        `;
-        
-        companiesList.appendChild(card);
-        
-        // Staggered fade-in animation
-        setTimeout(() => {
-            card.style.transition = 'opacity 0.4s ease-out, transform 0.4s ease-out';
-            card.style.opacity = '1';
-            card.style.transform = 'translateY(0)';
-        }, index * 30);
+        appendCompanyCard(company, index);
     });
 }
 
+function appendCompanyCard(company, index) {
+    const companiesList = document.getElementById('companiesList');
+    const card = document.createElement('div');
+    card.className = 'company-card';
+    card.style.opacity = '0';
+    card.style.transform = 'translateY(20px)';
+    
+    const countryClass = company.country === 'Canada' ? 'country-canada' : 'country-usa';
+    
+    card.innerHTML = `
+        <div class="company-name">${escapeHtml(company.name)}</div>
+        <div class="company-detail"><strong>Industry:</strong> ${escapeHtml(company.industry)}</div>
+        ${company.business_type ? `<div class="company-detail"><strong>Type:</strong> ${escapeHtml(company.business_type)}</div>` : ''}
+        <div class="company-detail"><strong>Address:</strong> ${escapeHtml(company.address || 'N/A')}</div>
+        ${company.phone ? `<div class="company-detail"><strong>Phone:</strong> <a href="tel:${escapeHtml(company.phone)}">${escapeHtml(company.phone)}</a></div>` : ''}
+        ${company.email ? `<div class="company-detail"><strong>Email:</strong> <a href="mailto:${escapeHtml(company.email)}">${escapeHtml(company.email)}</a></div>` : ''}
+        ${company.website ? `<div class="company-detail"><strong>Website:</strong> <a href="${escapeHtml(company.website)}" target="_blank">Visit</a></div>` : ''}
+        ${company.rating ? `<div class="company-detail"><strong>Rating:</strong> ${company.rating}/5</div>` : ''}
+        <span class="country-badge ${countryClass}">${escapeHtml(company.country)}</span>
+    `;
+    
+    companiesList.appendChild(card);
+    
+    // Staggered fade-in animation (capped so long lists don't take forever to appear)
+    setTimeout(() => {
+        card.style.transition = 'opacity 0.4s ease-out, transform 0.4s ease-out';
+        card.style.opacity = '1';
+        card.style.transform = 'translateY(0)';
+    }, Math.min(index, 30) * 30);
+}
+
 async function exportToExcel() {
     if (currentCompanies.length === 0) {
         showError('No companies to export. Please search for companies first.');
@@ -541,16 +747,20 @@ async function exportToExcel() {
     }
     
     try {
-        const response = await fetch('/api/export', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({ 
-                companies: currentCompanies,
-                search_query: currentSearchQuery || 'companies'
-            })
-        });
+        // Results are kept on the server, so only their id is sent; the POST
+        // fallback covers results that came without one
+        const response = currentResultId
+            ? await fetch(`/api/export/${encodeURIComponent(currentResultId)}?format=xlsx`)
+            : await fetch('/api/export', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify({ 
+                    companies: currentCompanies,
+                    search_query: currentSearchQuery || 'companies'
+                })
+            });
         
         if (!response.ok) {
             const error = await response.json();
@@ -566,7 +776,7 @@ async function exportToExcel() {
         const contentDisposition = response.headers.get('Content-Disposition');
         let downloadFilename = `companies_${new Date().toISOString().split('T')[0]}.xlsx`;
         if (contentDisposition) {
-            const filenameMatch = contentDisposition.match(/filename="(.+)"/);
+            const filenameMatch = contentDisposition.match(/filename="?([^";]+)"?/);
             if (filenameMatch) {
                 downloadFilename = filenameMatch[1];
             }